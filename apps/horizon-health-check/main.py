@@ -3,14 +3,24 @@ Health check for Horizon.
 
 Healthy: Corresponding stellar-core is 'Synced'
 Unhealthy: Corresponding stellar-core is not 'Synced'
+Degraded: Healthy, but Horizon ingests ledgers slower than Core closes them
+
+Core and Horizon are polled by a background refresher, and /status answers from the latest verdict,
+so load balancer probes don't add load to the checked node.
+Ledger samples of recent polls are kept in a rolling window, for ingestion rate and lag trends.
+Upstream latencies, check durations, ledger trends and verdict transitions are exposed on /metrics for Prometheus.
 """
 import json
+import threading
 import time
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from flask import Flask
 from flask_cors import CORS
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
 
 APP = Flask(__name__)
 CORS(APP)
@@ -21,40 +31,212 @@ CORE_INFO_URL = os.environ.get('CORE_INFO_URL')
 HORIZON_INFO_URL = os.environ.get('HORIZON_INFO_URL')
 BUILD_VERSION = os.environ.get('BUILD_VERSION')
 REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', 2))
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', 2))
+MAX_STALENESS = float(os.environ.get('MAX_STALENESS', 10))
+WINDOW_SIZE = int(os.environ.get('WINDOW_SIZE', 30))
+MIN_TREND_SAMPLES = int(os.environ.get('MIN_TREND_SAMPLES', 5))
+DEGRADED_RATE_RATIO = float(os.environ.get('DEGRADED_RATE_RATIO', 0.9))
+DEGRADED_STATUS_CODE = int(os.environ.get('DEGRADED_STATUS_CODE', 503))
 MAX_HEALTHY_DIFF = 10
+STATUSES = ('Healthy', 'Unhealthy', 'Degraded')
+
+METRICS = CollectorRegistry()
+UPSTREAM_DURATION = Histogram('horizon_health_upstream_request_duration_seconds',
+                              'duration of upstream requests to Core /info and Horizon root', ['upstream'], registry=METRICS)
+UPSTREAM_ERRORS = Counter('horizon_health_upstream_request_errors', 'failed upstream requests', ['upstream'], registry=METRICS)
+CHECK_DURATION = Histogram('horizon_health_check_duration_seconds', 'duration of health checks, including all upstream requests',
+                           registry=METRICS)
+TRANSITIONS = Counter('horizon_health_transitions', 'health check verdict changes, by new status', ['status'], registry=METRICS)
+STATUS = Gauge('horizon_health_status', 'whether the last health check verdict is of given status', ['status'], registry=METRICS)
+SAMPLE_AGE = Gauge('horizon_health_sample_age_seconds', 'age of the last health check verdict', registry=METRICS)
+TREND_GAUGES = {key: Gauge(f'horizon_health_{name}', description, registry=METRICS) for key, name, description in (
+    ('core_ledger', 'core_ledger', 'last Core ledger'),
+    ('horizon_core_ledger', 'horizon_core_ledger', 'last Core ledger seen by Horizon'),
+    ('history_ledger', 'history_ledger', 'last Horizon ingested ledger'),
+    ('lag', 'ledger_lag', 'Core ledger minus Horizon ingested ledger'),
+    ('close_rate', 'close_rate', 'Core ledgers closed per second over the sample window'),
+    ('ingestion_rate', 'ingestion_rate', 'Horizon ledgers ingested per second over the sample window'),
+    ('lag_slope', 'lag_slope', 'ledger lag change per second over the sample window'),
+)}
+for label in ('core', 'horizon'):
+    UPSTREAM_DURATION.labels(label)
+    UPSTREAM_ERRORS.labels(label)
+for label in STATUSES:
+    TRANSITIONS.labels(label)
+    STATUS.labels(label)
+
+
+class HealthChecker:
+    """Poll Core and Horizon concurrently in the background, keeping the latest health check verdict."""
+
+    def __init__(self, core_url, horizon_url, interval, timeout, window_size=WINDOW_SIZE):
+        self.core_url = core_url
+        self.horizon_url = horizon_url
+        self.interval = interval
+        self.timeout = timeout
+        self.session = requests.Session()  # keeps connections alive between polls
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.verdict = None  # (is healthy, description, sample timestamp)
+        self.status = None  # one of STATUSES, for counting transitions
+        self.samples = deque(maxlen=window_size)  # (timestamp, core ledger, horizon core ledger, history ledger)
+        self.trend = compute_trend(self.samples)
+
+    def get_upstream(self, upstream, url):
+        """Get JSON data from given upstream, recording request duration and errors."""
+        with UPSTREAM_DURATION.labels(upstream).time(), UPSTREAM_ERRORS.labels(upstream).count_exceptions():
+            return get_data(url, self.session, self.timeout)
+
+    @CHECK_DURATION.time()
+    def refresh(self):
+        """Poll Core and Horizon and update the verdict."""
+        try:
+            core_future = self.executor.submit(self.get_upstream, 'core', self.core_url)
+            horizon_future = self.executor.submit(self.get_upstream, 'horizon', self.horizon_url)
+            core_info = core_future.result()
+            horizon_info = horizon_future.result()
+
+            self.samples.append((time.time(),
+                                 int(core_info['info']['ledger']['num']),
+                                 int(horizon_info['core_latest_ledger']),
+                                 int(horizon_info['history_latest_ledger'])))
+            self.trend = compute_trend(self.samples)
+            update_trend_metrics(self.trend)
+
+            is_core_synced = core_info['info']['state'] == 'Synced!'
+            is_horizon_synced = get_horizon_sync_status(core_info, horizon_info)
+            msg = generate_status_msg(is_core_synced, is_horizon_synced)
+            self.verdict = (is_core_synced and is_horizon_synced, msg, time.time())
+        except Exception as e:
+            self.verdict = (False, f'Could not perform health check: {str(e)}', time.time())
+
+        self.update_status()
+
+    def update_status(self):
+        """Set status gauges according to the verdict, and count status transitions."""
+        if not self.verdict[0]:
+            status = 'Unhealthy'
+        elif self.trend['degraded']:
+            status = 'Degraded'
+        else:
+            status = 'Healthy'
+
+        if self.status is not None and status != self.status:
+            TRANSITIONS.labels(status).inc()
+        self.status = status
+        for label in STATUSES:
+            STATUS.labels(label).set(int(label == status))
+
+    def run(self):
+        while True:
+            start = time.time()
+            self.refresh()
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    def start(self):
+        """Start the background refresher once, after a first synchronous refresh."""
+        with self.lock:
+            if self.thread is None:
+                self.refresh()
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
 
 
 @APP.route("/status")
 def status():
-    """Check if the stellar core is synced."""
-    try:
-        core_info = get_data(CORE_INFO_URL)
-        horizon_info = get_data(HORIZON_INFO_URL)
-
-        is_core_synced = core_info['info']['state'] == 'Synced!'
-        is_horizon_synced = get_horizon_sync_status(core_info, horizon_info)
-        msg = generate_status_msg(is_core_synced, is_horizon_synced)
-        if is_core_synced and is_horizon_synced:
-            return make_reply(msg, 200)
-        return make_reply(msg, 503)
-    except Exception as e:
-        return make_reply(f'Could not perform health check: {str(e)}', 503)
-
-
-def make_reply(msg, code):
+    """Check if the stellar core is synced, according to the latest background poll."""
+    CHECKER.start()
+    return verdict_reply(CHECKER.verdict, CHECKER.trend, time.time())
+
+
+@APP.route("/metrics")
+def metrics():
+    """Export upstream latencies, check durations, ledger trends and verdict transitions in Prometheus text format."""
+    CHECKER.start()
+    SAMPLE_AGE.set(time.time() - CHECKER.verdict[2])
+    return generate_latest(METRICS), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+def verdict_reply(verdict, trend, now):
+    """Create a /status reply for given verdict, which is Unhealthy if older than MAX_STALENESS."""
+    is_healthy, msg, timestamp = verdict
+    sample_age = now - timestamp
+    if sample_age > MAX_STALENESS:
+        return make_reply(f'Health check is stale: last sample is {sample_age:.1f} seconds old', 503, sample_age)
+    if not is_healthy:
+        return make_reply(msg, 503, sample_age)
+    if trend['degraded']:
+        msg = (f'{msg}, Horizon is falling behind: ingesting {trend["ingestion_rate"]:.3f} ledgers/s, '
+               f'Core closing {trend["close_rate"]:.3f} ledgers/s')
+        return make_reply(msg, DEGRADED_STATUS_CODE, sample_age, 'Degraded')
+    return make_reply(msg, 200, sample_age)
+
+
+def make_reply(msg, code, sample_age, status=None):
     """Create a JSON reply for /status."""
     reply = {
-        'status': 'Healthy' if code == 200 else 'Unhealthy',
+        'status': status or ('Healthy' if code == 200 else 'Unhealthy'),
         'description': msg,
+        'sample_age': sample_age,
         'start_timestamp': START_TIMESTAMP,
         'build': BUILD_VERSION
     }
     return json.dumps(reply), code
 
 
-def get_data(url):
+def slope(xs, ys):
+    """Return least squares slope of given points, or None if there aren't two distinct x values."""
+    n = len(xs)
+    if n < 2:
+        return None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+
+def compute_trend(samples):
+    """Return Core close rate, Horizon ingestion rate and lag slope (ledgers per second) over given ledger samples.
+
+    Degraded if there are at least MIN_TREND_SAMPLES samples, and Horizon ingests slower than
+    DEGRADED_RATE_RATIO of the Core close rate, i.e. its lag keeps growing.
+    """
+    if not samples:
+        return {'core_ledger': None, 'horizon_core_ledger': None, 'history_ledger': None, 'lag': None,
+                'close_rate': None, 'ingestion_rate': None, 'lag_slope': None, 'degraded': False}
+
+    # relative timestamps, so squares don't lose float precision
+    start = samples[0][0]
+    times = [t - start for t, _, _, _ in samples]
+    core_ledgers = [s[1] for s in samples]
+    history_ledgers = [s[3] for s in samples]
+
+    close_rate = slope(times, core_ledgers)
+    ingestion_rate = slope(times, history_ledgers)
+    lag_slope = slope(times, [c - h for c, h in zip(core_ledgers, history_ledgers)])
+
+    degraded = (len(samples) >= MIN_TREND_SAMPLES and close_rate is not None and close_rate > 0
+                and ingestion_rate < close_rate * DEGRADED_RATE_RATIO)
+
+    _, core_ledger, horizon_core_ledger, history_ledger = samples[-1]
+    return {'core_ledger': core_ledger, 'horizon_core_ledger': horizon_core_ledger, 'history_ledger': history_ledger,
+            'lag': core_ledger - history_ledger, 'close_rate': close_rate, 'ingestion_rate': ingestion_rate,
+            'lag_slope': lag_slope, 'degraded': degraded}
+
+
+def update_trend_metrics(trend):
+    """Set ledger and trend gauges to given trend values, where unknown values are NaN."""
+    for key, gauge in TREND_GAUGES.items():
+        value = trend[key]
+        gauge.set(float('nan') if value is None else value)
+
+
+def get_data(url, session=requests, timeout=REQUEST_TIMEOUT):
     """Get JSON data from resource"""
-    response = requests.get(url, timeout=REQUEST_TIMEOUT)
+    response = session.get(url, timeout=timeout)
     response.raise_for_status()
     return response.json()
 
@@ -76,3 +258,6 @@ def get_horizon_sync_status(core_info, horizon_info):
     horizon_db_sync = abs(horizon_core_ledger - horizon_db_ledger) < MAX_HEALTHY_DIFF
     horizon_core_sync = abs(core_db_ledger - horizon_db_ledger) < MAX_HEALTHY_DIFF
     return horizon_db_sync and horizon_core_sync
+
+
+CHECKER = HealthChecker(CORE_INFO_URL, HORIZON_INFO_URL, REFRESH_INTERVAL, REQUEST_TIMEOUT)
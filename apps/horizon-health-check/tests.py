@@ -1,6 +1,9 @@
+import json
 import unittest
+from unittest import mock
 
-from .main import generate_status_msg, get_horizon_sync_status
+from .main import (MAX_STALENESS, METRICS, HealthChecker, compute_trend, generate_status_msg, get_horizon_sync_status,
+                   verdict_reply)
 
 
 class TestHealthCheck(unittest.TestCase):
@@ -34,3 +37,90 @@ class TestHealthCheck(unittest.TestCase):
         core_info = {'info': {'ledger': {'num': 50}}}
         horizon_info = {'core_latest_ledger': 45, 'history_latest_ledger': 54}
         self.assertTrue(get_horizon_sync_status(core_info, horizon_info))
+
+    def test_refresh(self):
+        checker = HealthChecker('core', 'horizon', 1, 1)
+        core_info = {'info': {'state': 'Synced!', 'ledger': {'num': 50}}}
+        horizon_info = {'core_latest_ledger': 50, 'history_latest_ledger': 50}
+
+        # Core and Horizon synced
+        with mock.patch(__package__ + '.main.get_data', side_effect=lambda url, *_: core_info if url == 'core' else horizon_info):
+            checker.refresh()
+        self.assertTrue(checker.verdict[0])
+
+        # Core not synced
+        core_info = {'info': {'state': 'Catching up', 'ledger': {'num': 50}}}
+        with mock.patch(__package__ + '.main.get_data', side_effect=lambda url, *_: core_info if url == 'core' else horizon_info):
+            checker.refresh()
+        self.assertFalse(checker.verdict[0])
+        self.assertEqual(checker.verdict[1], 'Core, Horizon status is: (not synced, synced)')
+
+        # Core unreachable
+        with mock.patch(__package__ + '.main.get_data', side_effect=IOError('unreachable')):
+            checker.refresh()
+        self.assertFalse(checker.verdict[0])
+        self.assertEqual(checker.verdict[1], 'Could not perform health check: unreachable')
+
+    def test_verdict_reply(self):
+        trend = compute_trend([])
+
+        # Fresh healthy verdict
+        body, code = verdict_reply((True, 'msg', 100), trend, 101)
+        self.assertEqual(code, 200)
+        self.assertEqual(json.loads(body)['sample_age'], 1)
+
+        # Fresh unhealthy verdict
+        body, code = verdict_reply((False, 'msg', 100), trend, 101)
+        self.assertEqual(code, 503)
+
+        # Fresh healthy verdict, falling behind
+        trend = compute_trend([(t, t // 5, t // 5, t // 10) for t in range(0, 100, 5)])
+        body, code = verdict_reply((True, 'msg', 100), trend, 101)
+        self.assertEqual(code, 503)
+        self.assertEqual(json.loads(body)['status'], 'Degraded')
+
+        # Stale healthy verdict
+        body, code = verdict_reply((True, 'msg', 100), trend, 101 + MAX_STALENESS)
+        self.assertEqual(code, 503)
+        self.assertEqual(json.loads(body)['status'], 'Unhealthy')
+
+    def test_compute_trend(self):
+        # No samples
+        self.assertFalse(compute_trend([])['degraded'])
+
+        # Horizon ingesting as fast as Core closes ledgers, 5 seconds per ledger
+        trend = compute_trend([(t, 1000 + t // 5, 1000 + t // 5, 998 + t // 5) for t in range(0, 100, 5)])
+        self.assertAlmostEqual(trend['close_rate'], 0.2)
+        self.assertAlmostEqual(trend['ingestion_rate'], 0.2)
+        self.assertAlmostEqual(trend['lag_slope'], 0)
+        self.assertEqual(trend['lag'], 2)
+        self.assertFalse(trend['degraded'])
+
+        # Horizon ingesting at half the Core close rate
+        trend = compute_trend([(t, 1000 + t // 5, 1000 + t // 5, 1000 + t // 10) for t in range(0, 100, 5)])
+        self.assertAlmostEqual(trend['lag_slope'], 0.1, places=2)
+        self.assertTrue(trend['degraded'])
+
+        # Falling behind, but too few samples to tell
+        self.assertFalse(compute_trend([(0, 1000, 1000, 1000), (5, 1001, 1001, 1000)])['degraded'])
+
+    def test_metrics(self):
+        checker = HealthChecker('core', 'horizon', 1, 1)
+        core_info = {'info': {'state': 'Synced!', 'ledger': {'num': 50}}}
+        horizon_info = {'core_latest_ledger': 50, 'history_latest_ledger': 48}
+        transitions = METRICS.get_sample_value('horizon_health_transitions_total', {'status': 'Unhealthy'})
+        errors = METRICS.get_sample_value('horizon_health_upstream_request_errors_total', {'upstream': 'core'})
+
+        with mock.patch(__package__ + '.main.get_data', side_effect=lambda url, *_: core_info if url == 'core' else horizon_info):
+            checker.refresh()
+        self.assertEqual(METRICS.get_sample_value('horizon_health_ledger_lag'), 2)
+        self.assertEqual(METRICS.get_sample_value('horizon_health_status', {'status': 'Healthy'}), 1)
+        self.assertGreater(METRICS.get_sample_value('horizon_health_upstream_request_duration_seconds_count', {'upstream': 'core'}), 0)
+
+        # Healthy to Unhealthy transition, with a failed Core request
+        with mock.patch(__package__ + '.main.get_data', side_effect=IOError('unreachable')):
+            checker.refresh()
+        self.assertEqual(METRICS.get_sample_value('horizon_health_status', {'status': 'Healthy'}), 0)
+        self.assertEqual(METRICS.get_sample_value('horizon_health_status', {'status': 'Unhealthy'}), 1)
+        self.assertEqual(METRICS.get_sample_value('horizon_health_transitions_total', {'status': 'Unhealthy'}), transitions + 1)
+        self.assertEqual(METRICS.get_sample_value('horizon_health_upstream_request_errors_total', {'upstream': 'core'}), errors + 1)
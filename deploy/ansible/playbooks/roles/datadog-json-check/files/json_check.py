@@ -1,33 +1,118 @@
 """Get a JSON response from a given URL, and extract a specific metric based on a given JSON path."""
 from hashlib import md5
+from multiprocessing.pool import ThreadPool
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
 
 from datadog_checks.checks import AgentCheck
 from datadog_checks.errors import CheckException
 from jsonpath_rw import parse
 
-__version__ = "2.0.0"
+__version__ = "2.2.0"
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RESPONSE_TTL = 5
+
+# Decoded responses by URL, shared by all instances so each URL is fetched once per collection cycle
+# (the agent may run instances in separate check objects and threads)
+_responses = {}  # URL: (fetch time, (response or request exception, decoded JSON, duration))
+_url_locks = {}
+_url_locks_lock = threading.Lock()
 
 
 class JSONCheck(AgentCheck):
     """This class holds the json_check check and all the relevant events."""
 
+    def __init__(self, *args, **kwargs):
+        super(JSONCheck, self).__init__(*args, **kwargs)
+        self.concurrency = self.init_config.get('concurrency', DEFAULT_CONCURRENCY)
+        self.response_ttl = self.init_config.get('response_ttl', DEFAULT_RESPONSE_TTL)
+
+        # Reuse connections between check runs, with enough pooled connections for concurrent requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.pool = None  # Created on first multiple URL check
+        self.expressions = {}  # Compiled JSON paths
+
     def check(self, instance):
         """Get a specific value from a json."""
         # datadog-agent agent collects values from the corresponding .yaml file
-        url = instance['url']
+        urls = instance.get('urls') or [instance['url']]
         metrics = instance['metrics']
         default_timeout = self.init_config.get('default_timeout', 5)
 
+        # Make get requests, concurrently if there are multiple URLs
+        if len(urls) == 1:
+            results = [self.fetch_shared(urls[0], default_timeout)]
+        else:
+            if self.pool is None:
+                self.pool = ThreadPool(self.concurrency)
+            results = self.pool.map(lambda url: self.fetch_shared(url, default_timeout), urls)
+
+        for url, ((r, data, duration), shared) in zip(urls, results):
+            # Tag metrics with their URL only if there are multiple URLs, to keep single URL metrics unchanged
+            tags = ['url:{}'.format(url)] if len(urls) > 1 else None
+            if not shared:
+                self.gauge('json_check.fetch_duration', duration, tags=['url:{}'.format(url)])
+            self.process_response(url, r, data, metrics, default_timeout, tags)
+
+    def fetch_shared(self, url, timeout):
+        """Return the fetch result of given URL, shared with other instances if fetched less than response_ttl seconds ago.
+
+        Also return whether the result is shared, i.e. was fetched by another instance or check run.
+        """
+        with _url_locks_lock:
+            lock = _url_locks.setdefault(url, threading.Lock())
+
+        # Instances of the same URL wait for a single fetch instead of fetching in parallel
+        with lock:
+            cached = _responses.get(url)
+            if cached is not None and time.time() - cached[0] < self.response_ttl:
+                return cached[1], True
+
+            result = self.fetch(url, timeout)
+            _responses[url] = (time.time(), result)
+            return result, False
+
+    def fetch(self, url, timeout):
+        """Get given URL, and return the response, its decoded JSON and request duration in seconds.
+
+        A failed request or an invalid JSON response is returned as an exception in place of the response,
+        so it fails only the metrics of its own URL.
+        """
+        start = time.time()
+        try:
+            r = self.session.get(url, timeout=timeout)
+            data = r.json() if r.ok else None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            return e, None, time.time() - start
+
+        return r, data, time.time() - start
+
+    def expression(self, path):
+        """Return the compiled expression of given JSON path, parsing it only once."""
+        expression = self.expressions.get(path)
+        if expression is None:
+            expression = self.expressions[path] = parse(path)
+        return expression
+
+    def process_response(self, url, r, data, metrics, timeout, tags):
+        """Send all metrics of a single URL response."""
         # Use a hash of the URL as an aggregation key
         aggregation_key = md5(url).hexdigest()
 
-        # Make a get request
-        try:
-            r = requests.get(url, timeout=default_timeout)
-        except requests.exceptions.Timeout:
-            self.timeout_event(url, default_timeout, aggregation_key)
+        if isinstance(r, requests.exceptions.Timeout):
+            self.timeout_event(url, timeout, aggregation_key)
+            return
+
+        if isinstance(r, Exception):
+            # If the request failed or the response isn't JSON
+            self.request_error_event(url, r, aggregation_key)
             return
 
         if not r.ok:
@@ -35,21 +120,19 @@ class JSONCheck(AgentCheck):
             self.status_code_event(url, r, aggregation_key)
             return
 
-        data = r.json()
         for metric in metrics:
             for name, obj in metric.items():
                 path, typ = obj['path'], obj['type'].lower()
                 try:
                     # Get the value from the path in the json file
-                    expression = parse(path)
-                    match = expression.find(data)[0].value
+                    match = self.expression(path).find(data)[0].value
 
                     if typ == 'gauge':
-                        self.gauge(name, float(match))
+                        self.gauge(name, float(match), tags=tags)
                     elif typ == 'count':
-                        self.count(name, float(match))
+                        self.count(name, float(match), tags=tags)
                     elif typ == 'rate':
-                        self.rate(name, float(match))
+                        self.rate(name, float(match), tags=tags)
                     else:
                         raise CheckException('Configuration error: Unknown metric type "{}" for metric "{}"'.format(typ, name))
 
@@ -69,6 +152,15 @@ class JSONCheck(AgentCheck):
             'aggregation_key': aggregation_key
         })
 
+    def request_error_event(self, url, e, aggregation_key):
+        self.event({
+            'timestamp': int(time.time()),
+            'event_type': 'json_check',
+            'msg_title': 'request failed',
+            'msg_text': 'Request to {} failed: {!r}'.format(url, e),
+            'aggregation_key': aggregation_key
+        })
+
     def status_code_event(self, url, r, aggregation_key):
         self.event({
             'timestamp': int(time.time()),
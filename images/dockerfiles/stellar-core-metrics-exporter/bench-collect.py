@@ -0,0 +1,78 @@
+#!/usr/bin/python
+"""Benchmark exporter CPU time per scrape against a saved core /metrics payload.
+
+Save a payload from a core node with:
+  curl http://stellar-core:11626/metrics > metrics.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import time
+
+from prometheus_client import generate_latest
+from prometheus_client.core import CollectorRegistry
+
+EXPORTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stellar-core-prometheus-exporter.py')
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='stellar-core Prometheus exporter collect() benchmark')
+  parser.add_argument('--metrics-file', type=str, required=True,
+                      help='saved core /metrics JSON payload')
+  parser.add_argument('--nodes', type=int,
+                      help='amount of nodes exporting the payload, default: 1',
+                      default=1)
+  parser.add_argument('--scrapes', type=int,
+                      help='amount of scrapes per benchmark, default: 1000',
+                      default=1000)
+  parser.add_argument('--full-export', action='store_true',
+                      help='benchmark full export mode')
+  return parser.parse_args()
+
+def load_exporter():
+  """Return the exporter module, which can't be imported by name because of the dashes in its file name."""
+  spec = importlib.util.spec_from_file_location('exporter', EXPORTER_PATH)
+  exporter = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(exporter)
+  return exporter
+
+class StaticPoller(object):
+  """Poller serving the same metrics for all nodes, changing snapshot generation on every scrape if polled is set."""
+
+  def __init__(self, exporter, metrics, nodes, polled):
+    self.polled = polled
+    self.generation = 0
+    self.nodes = {}
+    for i in range(nodes):
+      state = exporter.new_node_state()
+      state.update(metrics=metrics, last_success=time.time(), up=True)
+      self.nodes['node-{}'.format(i)] = state
+
+  def snapshot(self):
+    if self.polled:
+      self.generation += 1
+    return self.generation, {node: dict(state) for node, state in self.nodes.items()}
+
+def bench(exporter, metrics, nodes, scrapes, polled, full_export):
+  """Return CPU seconds per scrape, collecting and serializing all metrics."""
+  registry = CollectorRegistry()
+  registry.register(exporter.StellarCoreCollector(StaticPoller(exporter, metrics, nodes, polled), full_export))
+
+  start = time.process_time()
+  for _ in range(scrapes):
+    generate_latest(registry)
+  return (time.process_time() - start) / scrapes
+
+if __name__ == "__main__":
+  args = parse_args()
+  exporter = load_exporter()
+  with open(args.metrics_file) as f:
+    metrics = json.load(f)['metrics']
+
+  print('{} metrics, {} nodes, {} scrapes'.format(len(metrics), args.nodes, args.scrapes))
+  print('{:<40} {:>12}'.format('benchmark', 'ms/scrape'))
+  for title, polled in (('build families every scrape', True),
+                        ('reuse families between polls', False)):
+    duration = bench(exporter, metrics, args.nodes, args.scrapes, polled, args.full_export)
+    print('{:<40} {:>12.3f}'.format(title, duration * 1000))
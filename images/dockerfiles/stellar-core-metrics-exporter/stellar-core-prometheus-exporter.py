@@ -2,51 +2,255 @@
 
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import logging
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 # Prometheus client library
 from prometheus_client import start_http_server
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, SummaryMetricFamily, REGISTRY
 
-parser = argparse.ArgumentParser(description='simple stellar-core Prometheus exporter/scraper')
-parser.add_argument('--uri', type=str,
-                    help='core metrics uri, default: http://stellar-core:11626/metrics',
-                    default='http://stellar-core:11626/metrics')
-parser.add_argument('--port', type=int,
-                    help='HTTP bind port, default: 9473',
-                    default=9473)
-args = parser.parse_args()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+MAX_POLL_THREADS = 32
+METRIC_NAME_RE = re.compile('\.|-|\s')
+METRIC_HELP = {t: 'libmedida metric type: ' + t for t in ('timer', 'counter', 'meter', 'histogram')}
+
+# summary quantiles and the core metric fields holding them
+QUANTILES = (('0.75', '75%'), ('0.95', '95%'), ('0.99', '99%'))
+FULL_QUANTILES = (('0.5', 'median'), ('0.75', '75%'), ('0.95', '95%'), ('0.98', '98%'), ('0.99', '99%'), ('0.999', '99.9%'))
+# extra core metric fields exported as gauges in full export mode
+RATE_FIELDS = ('mean_rate', '1_min_rate', '5_min_rate', '15_min_rate')
+STATS_FIELDS = ('min', 'max', 'stddev')
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='simple stellar-core Prometheus exporter/scraper')
+  parser.add_argument('--uri', type=str, action='append',
+                      help='core metrics uri, optionally prefixed with a node name as name=uri (use multiple --uri flags for multiple nodes), '
+                           'default: http://stellar-core:11626/metrics')
+  parser.add_argument('--targets-file', type=str,
+                      help='file listing core metrics uris in --uri format, one per line. '
+                           're-read on every poll, so targets can be updated by service discovery')
+  parser.add_argument('--port', type=int,
+                      help='HTTP bind port, default: 9473',
+                      default=9473)
+  parser.add_argument('--interval', type=float,
+                      help='seconds between core metrics polls, default: 10',
+                      default=10)
+  parser.add_argument('--timeout', type=float,
+                      help='core metrics request timeout in seconds, default: 5',
+                      default=5)
+  parser.add_argument('--full-export', action='store_true',
+                      help='export all timer and meter fields (rates, min, max, stddev and all quantiles) and histograms, '
+                           'instead of only counts and 75/95/99 quantiles')
+  args = parser.parse_args()
+  if not args.uri and not args.targets_file:
+    args.uri = ['http://stellar-core:11626/metrics']
+  return args
+
+def parse_target(target):
+  """Return (node name, uri) for given target, where node name defaults to uri host and port."""
+  if '=' in target.split('://', 1)[0]:
+    return tuple(target.split('=', 1))
+  return urlparse(target).netloc, target
+
+def load_targets(uris, targets_file):
+  """Return a {node name: uri} dictionary of all targets given on command line or in targets file."""
+  targets = [t for t in uris or []]
+  if targets_file:
+    try:
+      with open(targets_file) as f:
+        targets.extend(l.strip() for l in f if l.strip() and not l.startswith('#'))
+    except IOError as e:
+      logging.error('error reading targets file %s: %r', targets_file, e)
+  return dict(parse_target(t) for t in targets)
+
+def new_node_state():
+  return {'metrics': None, 'last_success': None, 'duration': 0, 'up': False, 'errors': 0}
+
+class CoreMetricsPoller(object):
+  """Poll metrics of all core nodes concurrently in the background, keeping the latest snapshot of every node.
+
+  Prometheus scrapes are served from the snapshots, so every node is polled once per interval
+  regardless of how many scrapers there are, and a slow node doesn't block scrapes or other nodes.
+  """
+
+  def __init__(self, uris, targets_file, interval, timeout):
+    self.uris = uris
+    self.targets_file = targets_file
+    self.interval = interval
+    self.timeout = timeout
+    # pool a connection per poll thread, so concurrent polls reuse their connections
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=MAX_POLL_THREADS)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+    self.lock = threading.Lock()
+    self.nodes = {}
+    self.generation = 0  # incremented on every snapshot change
+
+  def poll_node(self, node, uri):
+    start = time.time()
+    try:
+      response = self.session.get(uri, timeout=self.timeout)
+      response.raise_for_status()
+      metrics = response.json()['metrics']
+    except (requests.RequestException, ValueError, KeyError) as e:
+      logging.error('error polling core metrics from %s: %r', uri, e)
+      with self.lock:
+        state = self.nodes.setdefault(node, new_node_state())
+        state['up'] = False
+        state['errors'] += 1
+        state['duration'] = time.time() - start
+      return
+
+    with self.lock:
+      state = self.nodes.setdefault(node, new_node_state())
+      state['metrics'] = metrics
+      state['last_success'] = time.time()
+      state['up'] = True
+      state['duration'] = state['last_success'] - start
+      self.generation += 1
+
+  def poll(self, pool):
+    targets = load_targets(self.uris, self.targets_file)
+
+    # forget nodes which were removed from targets
+    with self.lock:
+      for node in set(self.nodes) - set(targets):
+        del self.nodes[node]
+        self.generation += 1
+
+    # poll all nodes concurrently, so a poll takes as long as the slowest node
+    list(pool.map(lambda t: self.poll_node(*t), targets.items()))
+
+  def run(self):
+    with ThreadPoolExecutor(max_workers=MAX_POLL_THREADS) as pool:
+      while True:
+        start = time.time()
+        self.poll(pool)
+        time.sleep(max(0, self.interval - (time.time() - start)))
+
+  def start(self):
+    thread = threading.Thread(target=self.run, daemon=True)
+    thread.start()
+
+  def snapshot(self):
+    with self.lock:
+      return self.generation, {node: dict(state) for node, state in self.nodes.items()}
 
 class StellarCoreCollector(object):
+  def __init__(self, poller, full_export=False):
+    self.poller = poller
+    self.full_export = full_export
+    self.cache = (None, [])
+
   def collect(self):
-    response = requests.get(args.uri)
-    json = response.json()
-
-    metrics   = json['metrics']
-
-    # iterate over all metrics
-    for k in metrics:
-      underscores = re.sub('\.|-|\s', '_', k).lower()
-
-      if metrics[k]['type'] == 'timer':
-        # we have a timer, expose as a Prometheus Summary
-        underscores = underscores + '_' + metrics[k]['duration_unit']
-        summary = SummaryMetricFamily(underscores, 'libmedida metric type: ' + metrics[k]['type'], count_value=metrics[k]['count'], sum_value=(metrics[k]['mean'] * metrics[k]['count']))
-        # add stellar-core calculated quantiles to our summary
-        summary.add_sample(underscores, labels={'quantile':'0.75'}, value=metrics[k]['75%'])
-        summary.add_sample(underscores, labels={'quantile':'0.95'}, value=metrics[k]['95%'])
-        summary.add_sample(underscores, labels={'quantile':'0.99'}, value=metrics[k]['99%'])
-        yield summary
-      elif metrics[k]['type'] == 'counter':
-        # we have a counter, this is a Prometheus Gauge
-        yield GaugeMetricFamily(underscores, 'libmedida metric type: ' + metrics[k]['type'], value=metrics[k]['count'])
-      elif metrics[k]['type'] == 'meter':
-        # we have a meter, this is a Prometheus Counter
-        yield CounterMetricFamily(underscores, 'libmedida metric type: ' + metrics[k]['type'], value=metrics[k]['count'])
+    generation, snapshot = self.poller.snapshot()
+
+    # exporter self metrics
+    up = GaugeMetricFamily('stellar_core_exporter_up', 'whether the last core metrics poll succeeded', labels=['node'])
+    duration = GaugeMetricFamily('stellar_core_exporter_poll_duration_seconds', 'duration of the last core metrics poll', labels=['node'])
+    errors = CounterMetricFamily('stellar_core_exporter_poll_errors', 'total failed core metrics polls', labels=['node'])
+    last_success = GaugeMetricFamily('stellar_core_exporter_last_success_timestamp_seconds', 'time of the last successful core metrics poll', labels=['node'])
+    staleness = GaugeMetricFamily('stellar_core_exporter_staleness_seconds', 'age of the exported core metrics snapshot', labels=['node'])
+    for node, state in sorted(snapshot.items()):
+      up.add_metric([node], int(state['up']))
+      duration.add_metric([node], state['duration'])
+      errors.add_metric([node], state['errors'])
+      if state['last_success'] is not None:
+        last_success.add_metric([node], state['last_success'])
+        staleness.add_metric([node], time.time() - state['last_success'])
+    for family in (up, duration, errors, last_success, staleness):
+      yield family
+
+    # core metric families only change when a node is polled,
+    # so they are built once per poll and reused by all scrapes until the next one
+    cached_generation, families = self.cache
+    if cached_generation != generation:
+      families = build_families(snapshot, self.full_export)
+      self.cache = (generation, families)
+    for family in families:
+      yield family
+
+def build_families(snapshot, full_export=False):
+  """Return metric families of all nodes in given snapshot."""
+  # all nodes export the same metrics, so every metric family holds samples of all nodes
+  families = {}
+  for node, state in sorted(snapshot.items()):
+    if state['metrics'] is not None:
+      add_node_metrics(families, node, state['metrics'], full_export)
+  return list(families.values())
+
+def metric_name(k, metric, field=None):
+  """Return prometheus metric name for given core metric or one of its fields."""
+  name = METRIC_NAME_RE.sub('_', k).lower()
+  if metric['type'] == 'timer':
+    name = name + '_' + metric['duration_unit']
+  if field is not None:
+    name = name + '_' + field
+  return name
+
+def add_field_gauges(families, node, k, metric, fields):
+  """Add given core metric fields as gauges, one family per field, skipping fields missing in older core versions."""
+  for field in fields:
+    if field not in metric:
+      continue
+    name = metric_name(k, metric, field)
+    family = families.get(name)
+    if family is None:
+      family = families[name] = GaugeMetricFamily(name, 'libmedida {} {}'.format(metric['type'], field), labels=['node'])
+    family.add_metric([node], metric[field])
+
+def add_node_metrics(families, node, metrics, full_export=False):
+  """Add samples of given node metrics to metric families dictionary, labeled by node name."""
+  quantiles = FULL_QUANTILES if full_export else QUANTILES
+
+  # iterate over all metrics
+  for k, metric in metrics.items():
+    metric_type = metric['type']
+    if metric_type not in METRIC_HELP or (metric_type == 'histogram' and not full_export):
+      continue
+
+    name = metric_name(k, metric)
+    family = families.get(name)
+
+    if metric_type in ('timer', 'histogram'):
+      # we have a timer or histogram, expose as a Prometheus Summary
+      if family is None:
+        family = families[name] = SummaryMetricFamily(name, METRIC_HELP[metric_type], labels=['node'])
+      family.add_metric([node], count_value=metric['count'], sum_value=(metric['mean'] * metric['count']))
+      # add stellar-core calculated quantiles to our summary, skipping quantiles missing in older core versions
+      for quantile, field in quantiles:
+        if field not in metric:
+          continue
+        family.add_sample(name, labels={'node':node, 'quantile':quantile}, value=metric[field])
+      if full_export:
+        add_field_gauges(families, node, k, metric, STATS_FIELDS)
+        if metric_type == 'timer':
+          add_field_gauges(families, node, k, metric, RATE_FIELDS)
+    elif metric_type == 'counter':
+      # we have a counter, this is a Prometheus Gauge
+      if family is None:
+        family = families[name] = GaugeMetricFamily(name, METRIC_HELP[metric_type], labels=['node'])
+      family.add_metric([node], metric['count'])
+    elif metric_type == 'meter':
+      # we have a meter, this is a Prometheus Counter
+      if family is None:
+        family = families[name] = CounterMetricFamily(name, METRIC_HELP[metric_type], labels=['node'])
+      family.add_metric([node], metric['count'])
+      if full_export:
+        add_field_gauges(families, node, k, metric, RATE_FIELDS)
 
 if __name__ == "__main__":
-  REGISTRY.register(StellarCoreCollector())
+  args = parse_args()
+  poller = CoreMetricsPoller(args.uri, args.targets_file, args.interval, args.timeout)
+  poller.start()
+  REGISTRY.register(StellarCoreCollector(poller, args.full_export))
   start_http_server(args.port)
   while True: time.sleep(1)
@@ -0,0 +1,428 @@
+"""Create accounts using channel accounts as sequence number consumers.
+
+Account creation is pipelined in three stages, so worker processes sign while earlier transactions are in flight:
+
+1. Batch building: generated accounts are split into batches of MAX_OPS accounts, one batch per transaction.
+2. Signing: every channel takes batches as it has room for them, assigns them consecutive sequence numbers
+   ahead of submission, and signs them in the signing pool.
+3. Submission: every channel submits its signed transactions in sequence order,
+   with up to a bounded window of transactions in flight at once.
+
+Submissions can be recorded in a journal, so an interrupted account creation can be resumed, see journal.py.
+
+Very large account sets can be created through a tree of intermediate funder accounts, see create_accounts_tree().
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+from collections import Counter, deque
+from typing import AsyncIterable, Collection, List, Mapping
+
+import aiohttp
+
+from kin import Keypair
+from kin.blockchain.builder import Builder
+
+from helpers import MAX_OPS, TX_SET_SIZE, LoggingClientSession, post
+from journal import SETTLE_LEDGERS, Journal, get_applied_txs, wait_for_ledgers
+from sequences import SequenceManager, account_exists
+from signing import SigningPool
+
+
+SUBMIT_RETRIES = 3
+SUBMIT_WINDOW = 1  # in-flight transactions per channel
+SOURCE_INDEX = 0  # funding source account index in signing pool seed list
+QUARKS_PER_KIN = 10 ** 5  # transaction fees are in quarks, the smallest KIN unit
+FUNDER_RESERVE = 100  # KIN added to every funder's balance, covering its minimum balance
+MERGE_BACKOFF = 0.5
+
+
+def create_accounts_job(channel, sequence, source_kp: Keypair, kps: List[Keypair], starting_balance, channel_address, source=SOURCE_INDEX):
+    """Return a signing job for a transaction creating given accounts, see signing.py.
+
+    The channel account is the transaction source, and the funding source account
+    (at given signing pool index) is the source of all operations.
+    """
+    ops = [('create_account', kp.public_address, starting_balance, source) for kp in kps]
+    signers = [source] if channel_address != source_kp.public_address else []
+    return channel, sequence, ops, signers
+
+
+async def submit_tx(session, horizon_endpoint, xdr):
+    """Submit given transaction XDR to given Horizon, and return response status and data.
+
+    NOTE 504 means the transaction wasn't added to the next few ledgers, but it still might be.
+    """
+    try:
+        res = await post(session, '{}/transactions'.format(horizon_endpoint), {'tx': xdr}, [200, 400, 504])
+    except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+        res = {'status': 504, 'detail': repr(e)}
+
+    return res.get('status', 200), res
+
+
+def is_bad_seq(res):
+    """Return True if given transaction submission response is a tx_bad_seq error."""
+    return res.get('extras', {}).get('result_codes', {}).get('transaction') == 'tx_bad_seq'
+
+
+async def build_batches(account_batches: AsyncIterable[List[Keypair]], batches: asyncio.Queue, channels, skip: Collection[int] = ()):
+    """Split given account batches into transaction batches of MAX_OPS accounts, and put them in given queue.
+
+    Transaction batches are numbered by their position in the account stream regardless of account batch sizes,
+    i.e. batch i holds accounts i * MAX_OPS up to (i + 1) * MAX_OPS, so the same accounts make the same batches on resume.
+    Every transaction batch is put along with its index and failed submission attempts, unless its index is in given skip.
+    A None per channel is put at the end, marking there are no more batches.
+    """
+    index = 0
+    accounts = []
+    async for account_batch in account_batches:
+        accounts.extend(account_batch)
+        full = len(accounts) - len(accounts) % MAX_OPS
+        for i in range(0, full, MAX_OPS):
+            if index not in skip:
+                await batches.put((index, accounts[i:i + MAX_OPS], 0))
+            index += 1
+        accounts = accounts[full:]
+
+    if accounts and index not in skip:
+        await batches.put((index, accounts, 0))
+
+    for _ in range(channels):
+        await batches.put(None)
+
+
+class ChannelPipeline:
+    """Sign and submit create account transactions using a single channel account.
+
+    Batches are assigned consecutive sequence numbers and signed ahead, so a signed transaction is ready
+    as soon as there is room in the in-flight window.
+    Transactions are submitted in sequence order, since the network rejects a sequence number
+    that doesn't follow the previous one.
+    Once a transaction fails, the following ones are bound to fail as well:
+    they are all awaited, the channel sequence is resynced, and batches that weren't created are signed again.
+    A timed out transaction can still be applied, so it is signed again only once it is found missing
+    a few ledgers later.
+
+    A channel takes up to given quota of batches from the shared batch queue, if any,
+    so a funding source account doesn't create more accounts than it was funded for.
+    """
+
+    def __init__(self, pool: SigningPool, session, sequences: SequenceManager, channel, address, source_kp: Keypair,
+                 starting_balance, horizon_endpoint, window=SUBMIT_WINDOW, journal: Journal = None,
+                 source=SOURCE_INDEX, quota=None):
+        self.pool = pool
+        self.session = session
+        self.sequences = sequences
+        self.channel = channel
+        self.address = address
+        self.source_kp = source_kp
+        self.source = source
+        self.quota = quota
+        self.starting_balance = starting_balance
+        self.horizon_endpoint = horizon_endpoint
+        self.window = asyncio.Semaphore(window)
+        self.depth = 2 * window  # signed ahead and in flight transactions
+        self.journal = journal
+
+        self.sequence = None  # channel sequence number the next signed transaction follows
+        self.retries = deque()  # batches to sign again following a failed submission, with their index and attempts
+        self.created = 0
+        self.ledgers = Counter()  # {ledger: created accounts}
+
+    async def run(self, batches: asyncio.Queue):
+        """Create accounts of batches taken from given queue, until there are no more batches."""
+        self.sequence = await self.sequences.get(self.address, self.horizon_endpoint)
+        pending = deque()  # (batch, submission task, submitting event), in sequence order,
+        # where batch is (index, accounts, attempts, sequence)
+        exhausted = False
+        taken = 0
+
+        try:
+            while True:
+                # keep the pipeline full, signing ahead of submission
+                while len(pending) < self.depth and (self.retries or not exhausted):
+                    if self.retries:
+                        item = self.retries.popleft()
+                    else:
+                        item = await batches.get()
+                        taken += 1
+                        exhausted = self.quota is not None and taken == self.quota
+                    if item is None:
+                        exhausted = True
+                        break
+
+                    batch = item + (self.sequence,)
+                    previous = pending[-1][2] if pending else None
+                    submitting = asyncio.Event()
+                    task = asyncio.create_task(self.sign_and_submit(batch, previous, submitting))
+                    pending.append((batch, task, submitting))
+                    self.sequence += 1
+
+                if not pending:
+                    return
+
+                batch, task, _ = pending.popleft()
+                tx_hash, status, res = await task
+                if status == 200:
+                    self.sequences.advance(self.address)
+                    self.applied(batch, tx_hash, res)
+                else:
+                    await self.resync([(batch, tx_hash, status, res)] + [(b,) + await t for b, t, _ in pending])
+                    pending.clear()
+        finally:
+            # don't leave transactions submitting in the background if creation failed or was cancelled
+            for _, task, _ in pending:
+                task.cancel()
+
+    async def sign_and_submit(self, batch, previous: asyncio.Event, submitting: asyncio.Event):
+        """Sign a transaction creating accounts of given batch with its assigned channel sequence, and submit it.
+
+        Return transaction hash, and submission status and response.
+        Given events are set once the previous and this transaction acquire the in-flight window, respectively,
+        so transactions acquire the window in sequence order.
+        """
+        index, kps, _, sequence = batch
+        tx_hash, xdr = await self.pool.sign(create_accounts_job(
+            self.channel, sequence, self.source_kp, kps, self.starting_balance, self.address, self.source))
+
+        if previous is not None:
+            await previous.wait()
+
+        async with self.window:
+            submitting.set()
+            self.record(index, tx_hash, 'submitted')
+            return (tx_hash,) + await submit_tx(self.session, self.horizon_endpoint, xdr)
+
+    def record(self, index, tx_hash, status):
+        if self.journal is not None:
+            self.journal.record(index, tx_hash, self.address, status)
+
+    def applied(self, batch, tx_hash, res):
+        index, kps, _, _ = batch
+        self.record(index, tx_hash, 'applied')
+        self.created += len(kps)
+        self.ledgers[res.get('ledger')] += len(kps)
+
+    async def resync(self, results):
+        """Resync channel sequence following a failed submission, and queue batches that weren't created to be signed again.
+
+        Given results are of the failed transaction and all the ones following it, in sequence order.
+        """
+        self.sequences.invalidate(self.address)
+        current = await self.sequences.get(self.address, self.horizon_endpoint)
+
+        # a timed out transaction's result is unknown, and it can still be applied in the next few ledgers,
+        # so wait for them to close and check whether it was before signing its batch again
+        timed_out = [tx_hash for (_, _, _, sequence), tx_hash, status, _ in results if status == 504 and current <= sequence]
+        found = set()
+        if timed_out:
+            logging.warning('channel %s has %d timed out transactions, checking them after %d ledgers',
+                            self.address, len(timed_out), SETTLE_LEDGERS)
+            await wait_for_ledgers(self.horizon_endpoint, SETTLE_LEDGERS)
+            found = await get_applied_txs([self.horizon_endpoint], timed_out)
+            self.sequences.invalidate(self.address)
+            current = await self.sequences.get(self.address, self.horizon_endpoint)
+
+        logging.warning('channel %s submission failed, resynced sequence from %d to %d', self.address, self.sequence, current)
+
+        for batch, tx_hash, status, res in results:
+            index, kps, attempts, sequence = batch
+
+            # a timed out transaction was applied after all if the channel sequence has moved past the one used
+            if status == 200 or (status == 504 and (current > sequence or tx_hash in found)):
+                self.applied(batch, tx_hash, res)
+                continue
+
+            # a timed out transaction stays journaled as submitted, so resuming checks it again
+            if status == 400:
+                self.record(index, tx_hash, 'failed')
+
+            if status == 400 and not is_bad_seq(res):
+                logging.error('Error submitting create account transaction using channel %s: %s', self.address, res)
+                raise RuntimeError('Error submitting create account transaction using channel {}'.format(self.address))
+
+            if attempts == SUBMIT_RETRIES:
+                raise RuntimeError('Failed submitting create account transaction using channel {} after {} retries'.format(
+                    self.address, SUBMIT_RETRIES))
+            self.retries.append((index, kps, attempts + 1))
+
+        self.sequence = current
+
+
+async def run_channels(channels: List[ChannelPipeline], account_batches: AsyncIterable[List[Keypair]], window,
+                       created_batches: Collection[int] = ()):
+    """Create accounts of given account batches using given channel pipelines, skipping given already created batches."""
+    # a few batches per channel are built ahead, so channels don't wait for each other's batches
+    batches = asyncio.Queue(maxsize=2 * len(channels) * window)
+    await asyncio.gather(build_batches(account_batches, batches, len(channels), created_batches),
+                         *[c.run(batches) for c in channels])
+
+
+def log_created(channels: List[ChannelPipeline], sequences: SequenceManager, start):
+    """Log amount of accounts created by given channels since given time, and accounts created per ledger."""
+    created = sum(c.created for c in channels)
+    ledgers = sum((c.ledgers for c in channels), Counter())
+    ledgers.pop(None, None)  # ledger of timed out transactions is unknown
+    logging.info('created %d accounts in %.1f seconds, fetched channel sequences %d times', created, time.time() - start, sequences.fetches)
+    if ledgers:
+        logging.info('created %.0f accounts per ledger on average over %d ledgers, %d at one transaction per channel per ledger',
+                     sum(ledgers.values()) / len(ledgers), len(ledgers), MAX_OPS * len(channels))
+
+
+async def create_accounts(source_kp: Keypair, account_batches: AsyncIterable[List[Keypair]], channel_builders: List[Builder],
+                          horizon_endpoints: List[str], starting_balance: int, window=SUBMIT_WINDOW,
+                          journal: Journal = None, created_batches: Collection[int] = ()):
+    """Asynchronously create accounts of given account batches.
+
+    Account batches are consumed as they arrive (see seeds.stream_account_batches()),
+    so accounts of early batches are created while later batches are still being generated.
+    Accounts are created using given channel builders (as sequence number consumers)
+    and source keypair as funding source account, see ChannelPipeline.
+    Channel sequence numbers are tracked locally starting from each builder's sequence,
+    so throughput isn't bound by fetching them from Horizon after every transaction.
+
+    Submissions are recorded in given journal, and given already created batches are skipped, see build_batches().
+    """
+    logging.info('creating accounts using %d channels, %d in-flight transactions per channel', len(channel_builders), window)
+    if created_batches:
+        logging.info('skipping %d already created batches', len(created_batches))
+    start = time.time()
+
+    # sign using worker processes holding source and channel seeds,
+    # where channels are referenced by their index in the signing pool seed list
+    seeds = [source_kp.secret_seed] + [c.keypair.seed().decode() for c in channel_builders]
+    with SigningPool(channel_builders[0].network, channel_builders[0].fee, seeds) as pool:
+        async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=len(channel_builders) * window)) as session:
+            sequences = SequenceManager(session, {c.address: int(c.sequence) for c in channel_builders})
+            channels = [ChannelPipeline(pool, session, sequences, i, c.address, source_kp, starting_balance,
+                                        horizon_endpoints[i % len(horizon_endpoints)], window, journal)
+                        for i, c in enumerate(channel_builders, start=SOURCE_INDEX + 1)]
+            await run_channels(channels, account_batches, window, created_batches)
+
+    log_created(channels, sequences, start)
+
+
+def tree_shape(accounts, width):
+    """Return amount of funders and transactions per funder for creating given amount of accounts through given tree width."""
+    transactions = math.ceil(accounts / MAX_OPS)
+    width = max(1, min(width, transactions))
+    return width, math.ceil(transactions / width)
+
+
+async def create_funders(source_kp: Keypair, funder_kps: List[Keypair], quota, channel_builders: List[Builder],
+                         horizon_endpoints: List[str], starting_balance: int, window=SUBMIT_WINDOW,
+                         journal: Journal = None, created_batches: Collection[int] = ()):
+    """Create given funder accounts using given channel builders,
+    each funded for given quota of transactions creating accounts, and their transaction fees.
+    """
+    fee = channel_builders[0].fee
+    funder_balance = quota * MAX_OPS * starting_balance + math.ceil(quota * MAX_OPS * fee / QUARKS_PER_KIN) + FUNDER_RESERVE
+    logging.info('creating %d funders of %d accounts each', len(funder_kps), quota * MAX_OPS)
+
+    async def funder_batches():
+        yield funder_kps
+
+    await create_accounts(source_kp, funder_batches(), channel_builders, horizon_endpoints, funder_balance, window,
+                          journal, created_batches)
+
+
+async def merge_funder(pool: SigningPool, session, sequences: SequenceManager, funder, address, destination, horizon_endpoint):
+    """Merge given funder account into given destination account, returning its leftover balance.
+
+    Return True if merged, or False if all submission attempts failed.
+    """
+    for attempt in range(SUBMIT_RETRIES + 1):
+        if attempt:
+            # add jitter so funders failing together won't retry together
+            await asyncio.sleep(MERGE_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+        try:
+            # a previous attempt which timed out may have been applied after all
+            if attempt and not await account_exists(session, horizon_endpoint, address):
+                return True
+            sequence = await sequences.get(address, horizon_endpoint)
+        except RuntimeError as e:
+            res = repr(e)
+            continue
+
+        _, xdr = await pool.sign((funder, sequence, [('account_merge', destination, None, None)], []))
+        status, res = await submit_tx(session, horizon_endpoint, xdr)
+        if status == 200:
+            return True
+        if status == 400 and not is_bad_seq(res):
+            break
+        if status == 504:
+            await wait_for_ledgers(horizon_endpoint, SETTLE_LEDGERS)
+        sequences.invalidate(address)
+
+    logging.error('Error merging funder %s into %s: %s', address, destination, res)
+    return False
+
+
+async def create_accounts_tree(source_kp: Keypair, account_batches: AsyncIterable[List[Keypair]], accounts,
+                               funder_kps: List[Keypair], quota,
+                               channel_builders: List[Builder], horizon_endpoints: List[str], starting_balance: int,
+                               window=SUBMIT_WINDOW, journal: Journal = None, created_batches: Collection[int] = (),
+                               funder_batches: Mapping[str, int] = None) -> List[str]:
+    """Asynchronously create given amount of accounts of given account batches, through given intermediate funder accounts.
+
+    Funders (see create_funders()) create up to given quota of batches each in parallel, each being the source of its own
+    transactions, so transactions are signed by a single account, and throughput grows with tree width
+    instead of being bound by a single funding source account.
+    Given amount of batches already created per funder address are deducted from its quota when resuming,
+    and funders merged by a previous run are skipped.
+
+    Once all accounts are created, funders are merged into the source account, returning their leftover balances.
+    Return addresses of funders which failed merging, and so still hold their balances.
+    """
+    funder_batches = funder_batches or {}
+    fee = channel_builders[0].fee
+    width = len(funder_kps)
+
+    if width * window > TX_SET_SIZE:
+        logging.warning('%d funders with %d in-flight transactions each exceed the tx set size of %d, '
+                        'so some of their transactions will wait for later ledgers', width, window, TX_SET_SIZE)
+
+    logging.info('creating accounts using %d funders, %d in-flight transactions per funder', width, window)
+    if created_batches:
+        logging.info('skipping %d already created batches', len(created_batches))
+    start = time.time()
+
+    # every funder is its own channel, referenced by its index in the signing pool seed list
+    seeds = [kp.secret_seed for kp in funder_kps]
+    with SigningPool(channel_builders[0].network, fee, seeds) as pool:
+        async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=width * window)) as session:
+            # funder sequences are fetched on first use, since they are set by the ledger that created them
+            sequences = SequenceManager(session)
+
+            # funders merged by a previous run no longer exist, so they can neither create accounts nor be merged again
+            exist = await asyncio.gather(*[account_exists(session, horizon_endpoints[i % len(horizon_endpoints)], kp.public_address)
+                                           for i, kp in enumerate(funder_kps)])
+            funders = [(i, kp) for (i, kp), e in zip(enumerate(funder_kps), exist) if e]
+            if len(funders) < width:
+                logging.info('skipping %d funders merged by a previous run', width - len(funders))
+
+            channels = [ChannelPipeline(pool, session, sequences, i, kp.public_address, kp, starting_balance,
+                                        horizon_endpoints[i % len(horizon_endpoints)], window, journal, source=i,
+                                        quota=quota - funder_batches.get(kp.public_address, 0))
+                        for i, kp in funders]
+            # funders which used up their quota before resuming mustn't take any more batches
+            channels = [c for c in channels if c.quota > 0]
+
+            remaining = math.ceil(accounts / MAX_OPS) - len(created_batches)
+            if sum(c.quota for c in channels) < remaining:
+                raise RuntimeError('funders have quota left for {} transactions, but {} transactions are left to create accounts'.format(
+                    sum(c.quota for c in channels), remaining))
+
+            await run_channels(channels, account_batches, window, created_batches)
+            log_created(channels, sequences, start)
+
+            logging.info('merging %d funders into source account %s', len(funders), source_kp.public_address)
+            merged = await asyncio.gather(*[merge_funder(pool, session, sequences, i, kp.public_address, source_kp.public_address,
+                                                         horizon_endpoints[i % len(horizon_endpoints)])
+                                            for i, kp in funders])
+
+    return [kp.public_address for (_, kp), ok in zip(funders, merged) if not ok]
@@ -0,0 +1,251 @@
+"""Analyze transaction prioritization in a spam results report (see report.py).
+
+For every spam round and overall, prioritized and unprioritized transactions are compared by
+inclusion latency, share included in the ledger following their submission (next ledger),
+share dropped by Horizon (HTTP 500/504), and fill ratio of the next ledger.
+All statistics are computed with vectorized NumPy operations, so large columnar reports are analyzed in seconds.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+
+import numpy as np
+
+import columnar
+from ledger_fetcher import fetch_ledgers
+
+
+PERCENTILES = (50, 90, 99)
+DROPPED_STATUSES = (b'500', b'504')
+MASKED_GROUPS = 8
+CLOSE_TIME_RESOLUTION = 1  # seconds, horizon close times are truncated to whole seconds
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input', required=True, type=str,
+                        help='Spam results report, in columnar (.npy) or CSV format. '
+                             'CSV reports are parsed row by row, so only columnar reports are loaded fast')
+    parser.add_argument('--out', type=str, help='Analysis results JSON output')
+
+    parser.add_argument('--start-ledger', required=True, type=int, help='First ledger number of spam')
+    parser.add_argument('--end-ledger', required=True, type=int, help='Last ledger number of spam')
+    parser.add_argument('--horizon', required=True, type=str, help='Horizon endpoint URL, used for ledgers missing from cache')
+    parser.add_argument('--cache-dir', default='.ledger-cache', type=str, help='Ledger cache directory, use an empty value to disable caching')
+    parser.add_argument('--concurrency', default=20, type=int, help='Maximum amount of concurrent Horizon requests')
+    parser.add_argument('--max-tx-set-size', type=int, help='Ledger capacity for fill ratio, defaults to max_tx_set_size of every ledger')
+
+    return parser.parse_args()
+
+
+def ledger_headers(ledgers, max_tx_set_size=None):
+    """Return arrays of ledger numbers, close times and fill ratios for given fetched ledgers, sorted by ledger number."""
+    seqs = np.array(sorted(ledgers), dtype='i8')
+    close_times = np.array([ledgers[n]['ledger']['closed_at'].rstrip('Z') for n in seqs],
+                           dtype='datetime64[s]').astype('f8')
+    tx_counts = np.array([len(ledgers[n]['transactions']) for n in seqs], dtype='f8')
+
+    if max_tx_set_size:
+        sizes = np.full(len(seqs), max_tx_set_size, dtype='f8')
+    else:
+        sizes = np.array([int(ledgers[n]['ledger']['max_tx_set_size']) for n in seqs], dtype='f8')
+
+    return seqs, close_times, tx_counts / sizes
+
+
+def lookup(sorted_keys, values, keys, side='left'):
+    """Return values matching the position of given keys in given sorted keys, or -1 for keys past the last one."""
+    idx = np.searchsorted(sorted_keys, keys, side=side)
+    found = idx < len(sorted_keys)
+    return np.where(found, values[np.minimum(idx, len(sorted_keys) - 1)], -1)
+
+
+def inclusion_ledgers(report, seqs, close_times):
+    """Return the next ledger closed after each transaction's submission, and the ledger it was included in.
+
+    Both are -1 if unknown, e.g. for transactions which weren't included in any fetched ledger.
+    Close times have a whole second resolution, so a ledger is considered closed only by the end of its close second.
+    Transactions scheduled by ledger closes (see stress.py) rather use their target ledger and its close offset,
+    which were measured with sub-second precision.
+    """
+    next_ledger = lookup(close_times + CLOSE_TIME_RESOLUTION, seqs, report['submission_time'], side='right')
+
+    # a transaction submitted before its target ledger closed is next in line for it, otherwise for the one following it
+    if 'target_ledger' in report.dtype.names and 'close_offset' in report.dtype.names:
+        scheduled = report['target_ledger'] > 0
+        next_ledger = np.where(scheduled, report['target_ledger'] + (report['close_offset'] >= 0), next_ledger)
+
+    # ledger time is the close time of the ledger the transaction was included in
+    included = ~np.isnan(report['ledger_time'])
+    ledger = np.where(included, lookup(close_times, seqs, np.where(included, report['ledger_time'], 0)), -1)
+
+    # prefer ledger numbers returned by horizon on submission when available
+    if 'ledger' in report.dtype.names:
+        ledger = np.where(report['ledger'] > 0, report['ledger'], ledger)
+
+    return next_ledger, ledger
+
+
+def percentiles_higher(values, percentiles):
+    """Return given percentiles of given values, each being the value at or above its exact rank.
+
+    Same as np.percentile(values, percentiles, interpolation='higher'), whose argument name differs between NumPy versions.
+    """
+    idx = np.ceil(np.true_divide(percentiles, 100) * (len(values) - 1)).astype('i8')
+    return np.partition(values, idx)[idx]
+
+
+def group_percentiles(groups, values, ngroups, percentiles):
+    """Return a (percentiles, ngroups) array of given values' percentiles per group index.
+
+    NaN values are ignored, and percentiles of empty groups are NaN.
+    """
+    valid = ~np.isnan(values)
+    groups, values = groups[valid], values[valid]
+
+    counts = np.bincount(groups, minlength=ngroups)
+    if ngroups <= MASKED_GROUPS:
+        # few groups (e.g. prioritized or not) are faster to select by mask than by sorting
+        def group_values(g):
+            return values[groups == g]
+    else:
+        # stable sort by group so every group is a consecutive slice,
+        # skipped if groups are already in order e.g. rounds in spam results
+        if np.any(groups[1:] < groups[:-1]):
+            values = values[np.argsort(groups, kind='mergesort')]
+        ends = np.cumsum(counts)
+
+        def group_values(g):
+            return values[ends[g] - counts[g]:ends[g]]
+
+    # percentiles are computed by partitioning rather than sorting every group
+    res = np.full((len(percentiles), ngroups), np.nan)
+    for g in np.flatnonzero(counts):
+        res[:, g] = percentiles_higher(group_values(g), percentiles)
+    return res
+
+
+def group_stats(groups, ngroups, latency, ledgers_waited, next_ledger_hit, dropped):
+    """Return a list of statistics dictionaries, one per group index."""
+    counts = np.bincount(groups, minlength=ngroups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        included = np.bincount(groups, weights=~np.isnan(latency), minlength=ngroups) / counts
+        next_ledger = np.bincount(groups, weights=next_ledger_hit, minlength=ngroups) / counts
+        dropped = np.bincount(groups, weights=dropped, minlength=ngroups) / counts
+
+    latency_pcts = group_percentiles(groups, latency, ngroups, PERCENTILES)
+    ledgers_pcts = group_percentiles(groups, ledgers_waited, ngroups, PERCENTILES)
+
+    return [{'count': int(counts[g]),
+             'included': included[g],
+             'next_ledger': next_ledger[g],
+             'dropped': dropped[g],
+             'latency': {'p{}'.format(p): latency_pcts[i, g] for i, p in enumerate(PERCENTILES)},
+             'ledgers': {'p{}'.format(p): ledgers_pcts[i, g] for i, p in enumerate(PERCENTILES)}}
+            for g in range(ngroups)]
+
+
+def analyze(report, seqs, close_times, fill):
+    """Return prioritization statistics per spam round and overall for given report and ledger headers."""
+    next_ledger, ledger = inclusion_ledgers(report, seqs, close_times)
+
+    # latency is measured up to the end of the close second, since a ledger closes some time within it
+    latency = report['ledger_time'] + CLOSE_TIME_RESOLUTION - report['submission_time']
+    ledgers_waited = np.where((ledger > 0) & (next_ledger > 0), ledger - next_ledger + 1, np.nan)
+    next_ledger_hit = (ledger > 0) & (ledger == next_ledger)
+    dropped = np.isin(report['status'], DROPPED_STATUSES) if 'status' in report.dtype.names else np.zeros(len(report), '?')
+    prioritized = report['prioritized'].astype('i8')
+
+    # group transactions by round and priority, as group index = 2 * round index + prioritized
+    rounds, first, round_idx = np.unique(report['round'], return_index=True, return_inverse=True)
+    per_round = group_stats(2 * round_idx + prioritized, 2 * len(rounds), latency, ledgers_waited, next_ledger_hit, dropped)
+    overall = group_stats(prioritized, 2, latency, ledgers_waited, next_ledger_hit, dropped)
+
+    # all round transactions are submitted together, so the first one's next ledger is the round's next ledger
+    round_next_ledger = next_ledger[first]
+    round_fill = np.where(round_next_ledger > 0, lookup(seqs, fill, round_next_ledger), np.nan)
+
+    return {
+        'overall': {
+            'prioritized': overall[1],
+            'unprioritized': overall[0],
+            'fill': {'mean': np.mean(fill),
+                     'p50': np.percentile(fill, 50),
+                     'min': np.min(fill),
+                     'full': np.mean(fill >= 1)},
+        },
+        'rounds': [{'round': int(rnd),
+                    'next_ledger': int(round_next_ledger[i]),
+                    'fill': round_fill[i],
+                    'prioritized': per_round[2 * i + 1],
+                    'unprioritized': per_round[2 * i]}
+                   for i, rnd in enumerate(rounds)],
+    }
+
+
+def print_analysis(analysis):
+    """Print per round and overall statistics, latency in seconds."""
+    header = '{:>6} {:>8} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'
+    row = '{:>6} {:>8} {:>6} {:>6} {:>8.1%} {:>8.1%} {:>8.1%} {:>8.2f} {:>8.2f} {:>8.2f} {:>8}'
+    print(header.format('round', 'ledger', 'prio', 'count', 'incl', 'next', 'dropped', 'p50', 'p90', 'p99', 'fill'))
+
+    def print_row(rnd, ledger, prio, s, fill):
+        print(row.format(rnd, ledger, prio, s['count'], s['included'], s['next_ledger'], s['dropped'],
+                         *(s['latency']['p{}'.format(p)] for p in PERCENTILES),
+                         '' if math.isnan(fill) else '{:.1%}'.format(fill)))
+
+    for r in analysis['rounds']:
+        print_row(r['round'], r['next_ledger'], 'yes', r['prioritized'], r['fill'])
+        print_row(r['round'], r['next_ledger'], 'no', r['unprioritized'], math.nan)
+
+    overall = analysis['overall']
+    print_row('all', '', 'yes', overall['prioritized'], overall['fill']['mean'])
+    print_row('all', '', 'no', overall['unprioritized'], math.nan)
+    print('ledger fill ratio: mean {mean:.1%} median {p50:.1%} min {min:.1%}, full ledgers {full:.1%}'.format(**overall['fill']))
+
+
+def to_json(obj):
+    """Convert NumPy scalars for JSON serialization, writing NaN as null."""
+    if isinstance(obj, dict):
+        return {k: to_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [to_json(v) for v in obj]
+    if isinstance(obj, (float, np.floating)):
+        return None if math.isnan(obj) else float(obj)
+    if isinstance(obj, np.integer):
+        return int(obj)
+    return obj
+
+
+def main():
+    args = parse_args()
+
+    logging.info('loading report %s', args.input)
+    report = columnar.load(args.input) if columnar.is_columnar(args.input) else columnar.load_csv(args.input)
+    logging.info('loaded %d transactions', len(report))
+
+    ledgers = asyncio.run(fetch_ledgers(args.horizon, range(args.start_ledger, args.end_ledger + 1),
+                                        args.cache_dir, args.concurrency))
+    seqs, close_times, fill = ledger_headers(ledgers, args.max_tx_set_size)
+
+    logging.info('analyzing')
+    analysis = analyze(report, seqs, close_times, fill)
+    print_analysis(analysis)
+
+    if args.out:
+        logging.info('writing analysis to file %s', args.out)
+        with open(args.out, 'w') as f:
+            json.dump(to_json(analysis), f, indent=True)
+
+    logging.info('done')
+
+
+if __name__ == '__main__':
+    main()
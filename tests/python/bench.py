@@ -0,0 +1,220 @@
+"""Benchmark the load test toolchain against a local mock network (see mock_network.py).
+
+Keypair generation, transaction signing, submission throughput to Horizon and Core,
+and report generation are timed at several scales. Results are saved as JSON,
+so they can be compared between commits.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+import columnar
+from helpers import MIN_FEE, TX_SET_SIZE, generate_keypairs, send_txs_multiple_endpoints
+from ledger_fetcher import fetch_ledgers
+from mock_network import MockNetwork
+from report import columnar_report, json_report
+from signing import SigningPool
+
+
+PASSPHRASE = 'mock network'
+LATEST_LEDGER_RETRIES = 20
+LATEST_LEDGER_RETRY_DELAY = 0.1
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--scale', type=int, action='append', help='Amount of transactions (use multiple --scale flags), defaults to 1000 and 10000')
+    parser.add_argument('--out', default='bench-results-{}.json'.format(str(int(time.time()))), type=str, help='Benchmark results JSON output')
+    parser.add_argument('--latency', default=0, type=float, help='Mock network response latency in seconds')
+    parser.add_argument('--error-rate', default=0, type=float, help='Mock network request error rate, between 0 and 1')
+    parser.add_argument('--ledger-interval', default=1, type=float, help='Mock network seconds between ledger closes')
+
+    return parser.parse_args()
+
+
+def free_port():
+    """Return an available local TCP port."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_mock_network(port, latency, error_rate, ledger_interval):
+    # don't reuse the event loop inherited from the parent process
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    network = MockNetwork(PASSPHRASE, latency, error_rate, ledger_interval)
+    web.run_app(network.app(), host='127.0.0.1', port=port, access_log=None, print=None)
+
+
+async def start_mock_network(latency, error_rate, ledger_interval):
+    """Start a mock network in a separate process, so it doesn't compete with the benchmarked tools on the same event loop.
+
+    Return its endpoint URL and process.
+    """
+    port = free_port()
+    process = multiprocessing.Process(target=run_mock_network, args=(port, latency, error_rate, ledger_interval), daemon=True)
+    process.start()
+
+    endpoint = 'http://127.0.0.1:{}'.format(port)
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(endpoint) as res:
+                    if res.status == 200:
+                        return endpoint, process
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+
+
+async def latest_ledger(endpoint):
+    """Return latest closed ledger number of given mock network."""
+    async with aiohttp.ClientSession() as session:
+        for _ in range(LATEST_LEDGER_RETRIES):
+            try:
+                async with session.get(endpoint) as res:
+                    if res.status == 200:
+                        return (await res.json())['history_latest_ledger']
+                    error = 'HTTP {}'.format(res.status)
+            except aiohttp.ClientError as e:
+                error = repr(e)
+            await asyncio.sleep(LATEST_LEDGER_RETRY_DELAY)
+
+    raise RuntimeError('Failed getting latest ledger from {} after {} attempts: {}'.format(endpoint, LATEST_LEDGER_RETRIES, error))
+
+
+def timed(f, *args, **kwargs):
+    """Call given function and return its result and duration in seconds."""
+    start = time.perf_counter()
+    res = f(*args, **kwargs)
+    return res, time.perf_counter() - start
+
+
+async def async_timed(coro):
+    """Await given coroutine and return its result and duration in seconds."""
+    start = time.perf_counter()
+    res = await coro
+    return res, time.perf_counter() - start
+
+
+async def bench_scale(n, horizon, core, ledger_interval, tmpdir):
+    """Run all benchmarks for given amount of transactions and return results dictionary."""
+    logging.info('benchmarking %d transactions', n)
+    results = {'scale': n}
+
+    kps, duration = timed(generate_keypairs, n)
+    results['keypairs_per_sec'] = n / duration
+
+    # every account sends a single payment to the next one
+    jobs = [(i, 0, [('payment', kps[(i + 1) % n].public_address, 1, None)], []) for i in range(n)]
+    with SigningPool(PASSPHRASE, MIN_FEE, [kp.secret_seed for kp in kps]) as pool:
+        signed, duration = await async_timed(pool.sign_many(jobs))
+    results['sign_xdrs_per_sec'] = n / duration
+
+    hashes = [tx_hash for tx_hash, _ in signed]
+    xdrs = [xdr for _, xdr in signed]
+
+    first_ledger = await latest_ledger(horizon) + 1
+    submission_time = time.time()
+    responses, duration = await async_timed(send_txs_multiple_endpoints([horizon], xdrs, True, [200, 500, 504]))
+    results['horizon_submit_tps'] = n / duration
+
+    # core rejects transactions it already applied with a bad sequence error,
+    # so only a core network the transactions weren't submitted to accepts them
+    core_responses, duration = await async_timed(send_txs_multiple_endpoints([core], xdrs, False, [200]))
+    results['core_submit_tps'] = n / duration
+    results['core_pending'] = sum(r.get('status') == 'PENDING' for r in core_responses) / n
+    if results['core_pending'] < 1:
+        logging.warning('%.1f%% of core submissions were rejected', 100 * (1 - results['core_pending']))
+
+    # write spam results in both formats for report generation
+    tx_results = [{'hash': tx_hash,
+                   'round': i // TX_SET_SIZE,
+                   'prioritized': False,
+                   'submission_time': submission_time,
+                   'ledger': res.get('ledger', ''),
+                   'status': str(res.get('status', '')),
+                   'error': ''}
+                  for i, (tx_hash, res) in enumerate(zip(hashes, responses))]
+
+    json_path = os.path.join(tmpdir, 'results-{}.json'.format(n))
+    with open(json_path, 'w') as f:
+        for tx in tx_results:
+            f.write('{}\n'.format(json.dumps(tx)))
+    columnar_path = os.path.join(tmpdir, 'results-{}.npy'.format(n))
+    with open(columnar_path, 'wb') as f:
+        columnar.write_batch(f, tx_results)
+
+    # wait for all submitted transactions' ledgers to close
+    last_ledger = max([r['ledger'] for r in responses if 'ledger' in r], default=first_ledger)
+    await asyncio.sleep(max(0, last_ledger - await latest_ledger(horizon)) * ledger_interval)
+
+    ledgers, results['fetch_ledgers_sec'] = await async_timed(
+        fetch_ledgers(horizon, range(first_ledger, last_ledger + 1), cache_dir=None))
+    results['ledgers'] = len(ledgers)
+
+    _, results['report_columnar_sec'] = timed(
+        columnar_report, columnar.load(columnar_path), ledgers, os.path.join(tmpdir, 'report-{}.npy'.format(n)))
+    _, results['report_json_sec'] = timed(
+        json_report, json_path, ledgers, os.path.join(tmpdir, 'report-{}.csv'.format(n)))
+
+    logging.info('results: %s', results)
+    return results
+
+
+def git_commit():
+    """Return current git commit hash, or None if unavailable."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    """Run benchmarks at all scales and save results."""
+    args = parse_args()
+
+    # separate mock networks for horizon and core submission,
+    # so the same transactions aren't added to ledgers twice
+    horizon, horizon_process = await start_mock_network(args.latency, args.error_rate, args.ledger_interval)
+    core, core_process = await start_mock_network(args.latency, args.error_rate, args.ledger_interval)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = [await bench_scale(n, horizon, core, args.ledger_interval, tmpdir)
+                       for n in args.scale or [1000, 10000]]
+    finally:
+        horizon_process.terminate()
+        core_process.terminate()
+
+    out = {'commit': git_commit(),
+           'time': int(time.time()),
+           'cpus': multiprocessing.cpu_count(),
+           'latency': args.latency,
+           'error_rate': args.error_rate,
+           'results': results}
+
+    logging.info('writing benchmark results to file %s', args.out)
+    with open(args.out, 'w') as f:
+        json.dump(out, f, indent=True)
+
+    logging.info('done')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
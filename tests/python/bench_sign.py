@@ -0,0 +1,66 @@
+"""Benchmark transaction signing throughput (XDRs per second) against signing chunk size.
+
+Random accounts are signed for offline, so no network is needed.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from kin import Keypair
+
+from helpers import MIN_FEE
+from signing import SigningPool
+
+
+PASSPHRASE = 'signing benchmark'
+ACCOUNTS = 1000
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--txs', type=int, default=20000, help='Amount of transactions to sign for every chunk size')
+    parser.add_argument('--chunk-size', type=int, action='append',
+                        help='Chunk sizes to benchmark (use multiple --chunk-size flags), 0 means splitting transactions evenly between workers. '
+                             'Defaults to 1, 10, 100, 1000 and 0')
+    parser.add_argument('--workers', type=int, help='Amount of signing worker processes, defaults to CPU count')
+
+    return parser.parse_args()
+
+
+async def bench(pool: SigningPool, jobs, chunk_size):
+    """Sign given jobs in chunks of given size, and return XDRs per second."""
+    start = time.perf_counter()
+    if chunk_size == 1:
+        # one executor call per transaction
+        await asyncio.gather(*[pool.sign(job) for job in jobs])
+    else:
+        await pool.sign_many(jobs, chunk_size or None)
+    return len(jobs) / (time.perf_counter() - start)
+
+
+async def main():
+    """Print signing throughput for every chunk size."""
+    args = parse_args()
+
+    kps = [Keypair() for _ in range(ACCOUNTS)]
+    jobs = [(i % ACCOUNTS, i, [('payment', kps[(i + 1) % ACCOUNTS].public_address, 1, None)], [])
+            for i in range(args.txs)]
+
+    with SigningPool(PASSPHRASE, MIN_FEE, [kp.secret_seed for kp in kps], args.workers) as pool:
+        # warm up worker processes so process startup isn't measured
+        await pool.sign_many(jobs[:pool.workers])
+
+        print('{:>10} {:>12}'.format('chunk', 'xdrs/sec'))
+        for chunk_size in args.chunk_size or [1, 10, 100, 1000, 0]:
+            rate = await bench(pool, jobs, chunk_size)
+            print('{:>10} {:>12.0f}'.format(chunk_size or 'auto', rate))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
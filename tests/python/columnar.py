@@ -0,0 +1,116 @@
+"""Columnar spam results format.
+
+A columnar results file is a sequence of NumPy structured arrays (record batches)
+written one after the other with numpy.save(), usually one batch per spam round.
+Loading it returns a single structured array, which can be processed with vectorized operations
+instead of parsing and handling every transaction result separately.
+"""
+import csv
+import os
+
+import numpy as np
+
+
+# column types of transaction result fields. string lengths are set per batch.
+FIELD_TYPES = {
+    'hash': 'S64',
+    'round': 'i4',
+    'prioritized': '?',
+    'submission_time': 'f8',
+    'ledger': 'i8',
+    'status': 'S',
+    'error': 'S',
+    'target_ledger': 'i8',
+    'ledger_close_time': 'f8',
+    'close_offset': 'f8',
+    'ledger_time': 'f8',
+}
+
+# values stored for empty fields e.g. ledger number of a transaction which wasn't included in a ledger
+MISSING_VALUES = {'i': 0, 'f': np.nan, 'b': False, 'S': b''}
+
+# ledger number fields, where 0 is a missing value rather than a ledger since ledgers are numbered from 1
+LEDGER_FIELDS = ('ledger', 'target_ledger')
+
+
+def is_columnar(path):
+    """Return True if given path is a columnar results file, according to its extension."""
+    return path.endswith('.npy')
+
+
+def to_records(results):
+    """Convert given list of transaction result dictionaries to a structured array."""
+    fields = list(results[0].keys())
+
+    columns = []
+    dtype = []
+    for name in fields:
+        typ = np.dtype(FIELD_TYPES.get(name, 'S'))
+        missing = MISSING_VALUES[typ.kind]
+        values = [missing if tx[name] == '' else tx[name] for tx in results]
+        if typ.kind == 'S':
+            values = [v if isinstance(v, bytes) else str(v).encode() for v in values]
+            typ = np.dtype('S{}'.format(max(1, max(len(v) for v in values))))
+
+        columns.append(np.array(values, dtype=typ))
+        dtype.append((name, typ))
+
+    records = np.empty(len(results), dtype=dtype)
+    for name, column in zip(fields, columns):
+        records[name] = column
+    return records
+
+
+def write_batch(f, results):
+    """Append given transaction results to a columnar results file as a single record batch."""
+    if not results:
+        return
+    np.save(f, to_records(results), allow_pickle=False)
+    f.flush()
+
+
+def iter_batches(path):
+    """Yield record batches from given columnar results file."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
+            yield np.load(f, allow_pickle=False)
+
+
+def load(path):
+    """Load all record batches from given columnar results file as a single structured array."""
+    batches = list(iter_batches(path))
+    if not batches:
+        raise RuntimeError('no results found in {}'.format(path))
+
+    # string columns can have a different length in every batch, so cast all batches to the longest one
+    dtype = []
+    for name in batches[0].dtype.names:
+        typ = batches[0].dtype[name]
+        if typ.kind == 'S':
+            typ = np.dtype('S{}'.format(max(b.dtype[name].itemsize for b in batches)))
+        dtype.append((name, typ))
+
+    return np.concatenate([b.astype(dtype) for b in batches])
+
+
+def save(path, records):
+    """Save given structured array as a columnar results file with a single record batch."""
+    with open(path, 'wb') as f:
+        np.save(f, records, allow_pickle=False)
+
+
+def load_csv(path):
+    """Load a CSV report (see report.py) as a structured array."""
+    with open(path) as f:
+        results = list(csv.DictReader(f))
+    if not results:
+        raise RuntimeError('no results found in {}'.format(path))
+
+    # csv values are all strings, so convert boolean fields explicitly
+    for name, typ in FIELD_TYPES.items():
+        if name in results[0] and np.dtype(typ).kind == 'b':
+            for tx in results:
+                tx[name] = tx[name] == 'True'
+
+    return to_records(results)
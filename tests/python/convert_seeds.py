@@ -0,0 +1,42 @@
+"""Convert a newline-delimited text seeds file to a binary seed store, see seeds.py."""
+import argparse
+import logging
+import os
+
+from seeds import iter_seed_file_batches, write_raw_accounts
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--input', required=True, type=str, help='Text seeds file path')
+    parser.add_argument('--out', required=True, type=str, help='Binary seed store output path')
+    parser.add_argument('--workers', type=int, help='Amount of worker processes deriving public keys, defaults to CPU count')
+
+    return parser.parse_args()
+
+
+def main():
+    """Convert text seeds file to binary seed store, deriving public keys in worker processes."""
+    args = parse_args()
+
+    logging.info('converting seeds file %s to binary seed store %s', args.input, args.out)
+
+    converted = 0
+    # write to a temporary file first so an interrupted run doesn't leave a partial seed store behind
+    with open(args.out + '.tmp', 'wb') as f:
+        for accounts in iter_seed_file_batches(args.input, workers=args.workers):
+            write_raw_accounts(f, accounts)
+            converted += len(accounts)
+            logging.info('converted %d seeds', converted)
+
+    os.replace(args.out + '.tmp', args.out)
+    logging.info('done')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,20 @@
 """Create accounts using given channel seeds (as sequence number consumers) and root account seed (as source account)."""
 import asyncio
 import argparse
+import contextlib
 import json
 import logging
+import os
 
 from kin import KinClient, Environment, Keypair
 from kin.blockchain.builder import Builder
 
-from helpers import (NETWORK_NAME, MIN_FEE,
-                     load_accounts, generate_keypairs, get_sequences_multiple_endpoints,
-                     create_accounts)
+from accounts import SUBMIT_WINDOW, create_accounts, create_accounts_tree, create_funders, tree_shape
+from helpers import NETWORK_NAME, MIN_FEE, load_accounts
+from journal import Journal, applied_channel_batches, resume_journal
+from seeds import (is_seed_store, iter_seed_file_batches, stream_account_batches, stream_batches, trim_seeds_file,
+                   write_raw_accounts, write_seeds)
+from sequences import get_sequences_multiple_endpoints
 
 
 STARTING_BALANCE = 1e5
@@ -28,7 +33,28 @@ def parse_args():
     parser.add_argument('--passphrase', required=True, type=str, help='Network passphrase')
     parser.add_argument('--horizon', action='append', help='Horizon endpoint URL (use multiple --horizon flags for multiple addresses)')
     parser.add_argument('--json-output', required=False, type=bool, help='Export output to json format')
-    return parser.parse_args()
+    parser.add_argument('--seeds-file', type=str,
+                        help='File path to write created account seeds to as they are generated, instead of printing them at the end')
+    parser.add_argument('--binary-seeds', action='store_true', help='Write seeds file as a binary seed store instead of text')
+    parser.add_argument('--submit-window', type=int, default=SUBMIT_WINDOW, help='Amount of in-flight transactions per channel')
+    parser.add_argument('--journal', type=str,
+                        help='File path to journal submitted transactions to, resuming account creation if it exists (requires --seeds-file). '
+                             'Funder creation is journaled to the same path with a .funders suffix')
+
+    parser.add_argument('--funders', type=int,
+                        help='Amount of intermediate funder accounts creating the accounts in parallel, instead of the source account')
+    parser.add_argument('--funders-seeds-file', type=str,
+                        help='File path to write funder seeds to before they are funded, '
+                             'defaults to the seeds file path with a .funders suffix')
+
+    args = parser.parse_args()
+    if args.journal and not args.seeds_file:
+        parser.error('--journal requires --seeds-file')
+    if args.funders and not (args.funders_seeds_file or args.seeds_file):
+        parser.error('--funders requires --funders-seeds-file or --seeds-file')
+    if args.funders and not args.funders_seeds_file:
+        args.funders_seeds_file = '{}.funders'.format(args.seeds_file)
+    return args
 
 
 async def init_channel_builders(channel_seeds_file, passphrase, horizon):
@@ -46,16 +72,123 @@ async def init_channel_builders(channel_seeds_file, passphrase, horizon):
     return channel_builders
 
 
+async def write_batches(batches, f, binary):
+    """Write seeds of every account batch to given file before passing it on, so no funded account seed is lost."""
+    async for batch in batches:
+        if binary:
+            write_raw_accounts(f, batch)
+        else:
+            write_seeds(f, batch)
+        f.flush()
+        yield batch
+
+
+async def resumed_batches(path, n, f, binary):
+    """Yield account batches stored in given seeds file by a previous run,
+    followed by generated account batches up to given total amount, which are written to given file.
+    """
+    stored = 0
+    async for batch in stream_batches(iter_seed_file_batches(path)):
+        stored += len(batch)
+        yield batch
+
+    logging.info('resuming with %d accounts of seeds file %s', stored, path)
+    async for batch in write_batches(stream_account_batches(max(0, n - stored)), f, binary):
+        yield batch
+
+
+async def collect_batches(batches, kps):
+    """Add accounts of every account batch to given list before passing it on."""
+    async for batch in batches:
+        kps.extend(batch)
+        yield batch
+
+
+def init_funders(path, width):
+    """Generate funder keypairs and write their seeds to given file, so no funded funder seed is lost."""
+    funder_kps = [Keypair() for _ in range(width)]
+    with open(path, 'w') as f:
+        write_seeds(f, funder_kps)
+    return funder_kps
+
+
+def load_funders(path, width):
+    """Load funder keypairs of a previous run from given funders seeds file."""
+    funder_kps = load_accounts(path)
+    if len(funder_kps) != width:
+        raise RuntimeError('funders seeds file {} has {} funders instead of {}'.format(path, len(funder_kps), width))
+    return funder_kps
+
+
+async def create_tree(args, source_kp, account_batches, channel_builders, journal=None, created_batches=()):
+    """Create accounts of given account batches through intermediate funders, see accounts.create_accounts_tree().
+
+    Funder seeds are written to the funders seeds file before they are funded.
+    When resuming, funders of the previous run are reused, and funders which weren't created are created again.
+    """
+    width, quota = tree_shape(args.accounts, args.funders)
+    funders_journal = args.journal and '{}.funders'.format(args.journal)
+
+    if funders_journal and os.path.exists(funders_journal):
+        funder_kps = load_funders(args.funders_seeds_file, width)
+        funded_batches = await resume_journal(funders_journal, args.horizon)
+        funder_batches = applied_channel_batches(args.journal)
+        logging.info('resuming with %d funders of funders seeds file %s', width, args.funders_seeds_file)
+    else:
+        funder_kps = init_funders(args.funders_seeds_file, width)
+        funded_batches, funder_batches = (), {}
+
+    with (Journal(funders_journal) if funders_journal else contextlib.nullcontext()) as f_journal:
+        await create_funders(source_kp, funder_kps, quota, channel_builders, args.horizon, STARTING_BALANCE, args.submit_window,
+                             f_journal, funded_batches)
+
+    unmerged = await create_accounts_tree(source_kp, account_batches, args.accounts, funder_kps, quota, channel_builders,
+                                          args.horizon, STARTING_BALANCE, args.submit_window, journal, created_batches,
+                                          funder_batches)
+    if unmerged:
+        logging.warning('%d funders failed merging into the source account and still hold their leftover balances, '
+                        'their seeds are in funders seeds file %s', len(unmerged), args.funders_seeds_file)
+
+
+async def create(args, source_kp, account_batches, channel_builders, journal=None, created_batches=()):
+    """Create accounts of given account batches, either directly or through intermediate funders."""
+    if args.funders:
+        await create_tree(args, source_kp, account_batches, channel_builders, journal, created_batches)
+    else:
+        await create_accounts(source_kp, account_batches, channel_builders, args.horizon, STARTING_BALANCE, args.submit_window,
+                              journal, created_batches)
+
+
 async def main():
-    """Create accounts and print their seeds to stdout."""
+    """Create accounts and print their seeds to stdout, or stream them to a seeds file."""
     args = parse_args()
 
     # initialize channels
     channel_builders = await init_channel_builders(args.channel_seeds_file, args.passphrase, args.horizon)
-    kps = generate_keypairs(args.accounts)
     source_kp = Keypair(args.source_account)
 
-    await create_accounts(source_kp, kps, channel_builders, args.horizon, STARTING_BALANCE)
+    # resume using accounts of the previous run's seeds file, skipping batches its journal shows were created
+    if args.journal and os.path.exists(args.journal):
+        trim_seeds_file(args.seeds_file)
+        binary = is_seed_store(args.seeds_file) if os.path.getsize(args.seeds_file) else args.binary_seeds
+        created_batches = await resume_journal(args.journal, args.horizon)
+
+        with open(args.seeds_file, 'ab' if binary else 'a') as f, Journal(args.journal) as journal:
+            await create(args, source_kp, resumed_batches(args.seeds_file, args.accounts, f, binary), channel_builders,
+                         journal, created_batches)
+        return
+
+    # accounts are generated in batches, and funded while later batches are still being generated
+    batches = stream_account_batches(args.accounts)
+
+    if args.seeds_file:
+        with open(args.seeds_file, 'wb' if args.binary_seeds else 'w') as f, \
+                (Journal(args.journal) if args.journal else contextlib.nullcontext()) as journal:
+            await create(args, source_kp, write_batches(batches, f, args.binary_seeds), channel_builders, journal)
+        return
+
+    kps = []
+    await create(args, source_kp, collect_batches(batches, kps), channel_builders)
 
     if args.json_output:
         keypairs = []
@@ -6,7 +6,6 @@ which is possible for unprioritized transactions and other unknown cases (which
 """
 import argparse
 import asyncio
-import concurrent.futures
 import json
 import itertools
 import logging
@@ -15,10 +14,11 @@ import time
 from typing import List
 
 from kin import Keypair, Environment
-from kin.blockchain.builder import Builder
 
-from helpers import (TX_SET_SIZE, NETWORK_NAME, MIN_FEE,
-                     load_accounts, get_sequences_multiple_endpoints)
+from helpers import TX_SET_SIZE, NETWORK_NAME, MIN_FEE
+from seeds import open_accounts, signing_seeds
+from sequences import get_sequences_cached, get_sequences_multiple_endpoints
+from signing import SigningPool
 
 
 PAYMENT_AMOUNT = 1
@@ -33,125 +33,120 @@ def parse_args():
 
     parser.add_argument('--length', required=True, type=int, help='Test length in seconds')
     parser.add_argument('--txs-per-ledger', required=True, type=int, help='Transaction rate to submit (spam) in parallel for every ledger round')
-    parser.add_argument('--prioritizer-seeds-file', required=True, type=str, help='File path to prioritizer seeds file')
-    parser.add_argument('--spammer-seeds-file', required=True, type=str, help='File path to spammer seeds file')
+    parser.add_argument('--prioritizer-seeds-file', required=True, type=str, help='File path to prioritizer seeds file (text or binary seed store)')
+    parser.add_argument('--spammer-seeds-file', required=True, type=str, help='File path to spammer seeds file (text or binary seed store)')
     parser.add_argument('--out', default='spam-results-{}.json'.format(str(int(time.time()))), type=str, help='Spam results JSON output')
     parser.add_argument('--avg-block-time', type=int, default=5, help='Average block time. Controls the time delay between every spam round and the one just after that')
 
+    parser.add_argument('--sign-chunk-size', type=int,
+                        help='Amount of transactions sent to a signing worker process at once, defaults to splitting every round evenly between workers')
     parser.add_argument('--passphrase', type=str, help='Network passphrase')
     parser.add_argument('--horizon', action='append',
                         help='Horizon endpoint URL (use multiple --horizon flags for multiple addresses)')
+    parser.add_argument('--sequences-cache', type=str,
+                        help='Spammer sequence numbers cache file, reused by later runs. '
+                             'Delete it after spammers submit transactions, since cached sequences are then out of date')
 
     return parser.parse_args()
 
 
-async def generate_spam_tx_xdrs(prioritizers, builders, length, tx_per_ledger, avg_block_time):
-    """Generate transaction XDR objects for each builder according to given spam rate.
+async def generate_spam_tx_xdrs(pool: SigningPool, spam_kps: List[Keypair], spam_sequences, prioritizer_indexes, length, tx_per_ledger, avg_block_time, chunk_size=None):
+    """Generate transaction XDR objects for each spammer account according to given spam rate.
 
-    NOTE each spam builder generates a single XDR, thus it should be used only once during a spam test.
+    Spammer accounts are referenced by their index in given signing pool, same as their index in given keypair list.
+
+    NOTE each spammer account generates a single XDR, thus it should be used only once during a spam test.
     This is to avoid sequence number collissions in case transactions do not get processed,
     which is possible for unprioritized transactions and other unknown cases (which this test attempts to uncover).
     """
     rounds_num = math.ceil(length // avg_block_time)
-    if len(builders) != tx_per_ledger * rounds_num:
+    if len(spam_kps) != tx_per_ledger * rounds_num:
         raise RuntimeError('Amount of spammer seeds should exactly match (transactions per ledger * spam round numbers)')
 
-    with concurrent.futures.ProcessPoolExecutor() as process_pool:
-        futurs = []
-        remaining_builders = builders
-        for rnd in range(rounds_num):
-            # pop builders for this round and trim original builder list
-            round_builders = remaining_builders[-tx_per_ledger:]
-            remaining_builders = remaining_builders[:-tx_per_ledger]
+    futurs = []
+    remaining_spammers = list(range(len(spam_kps)))
+    for rnd in range(rounds_num):
+        # pop spammers for this round and trim original spammer list
+        round_spammers = remaining_spammers[-tx_per_ledger:]
+        remaining_spammers = remaining_spammers[:-tx_per_ledger]
 
-            assert round_builders
+        assert round_spammers
 
-            coro = generate_spam_round_tx_xdrs(process_pool,
-                                               prioritizers,
-                                               round_builders[:TX_SET_SIZE - 1],
-                                               round_builders[TX_SET_SIZE-1:tx_per_ledger],
-                                               rnd)
+        coro = generate_spam_round_tx_xdrs(pool,
+                                           spam_kps,
+                                           spam_sequences,
+                                           prioritizer_indexes,
+                                           round_spammers[:TX_SET_SIZE - 1],
+                                           round_spammers[TX_SET_SIZE-1:tx_per_ledger],
+                                           rnd,
+                                           chunk_size)
 
-            futurs.append(asyncio.create_task(coro))
+        futurs.append(asyncio.create_task(coro))
 
-        spam_rounds = await asyncio.gather(*futurs)
+    spam_rounds = await asyncio.gather(*futurs)
 
     return spam_rounds
 
 
-def build_and_sign(builder, dest_address, payment_amount, prioritizer_seed=None):
-    """Build a transaction for given builder and return transaction hash and XDR."""
-    builder.append_payment_op(dest_address, str(payment_amount))
-    builder.sign(builder.keypair.seed().decode())
+def payment_job(source, sequence, dest_address, payment_amount, prioritizer=None):
+    """Return a signing job for a payment transaction, see signing.py.
 
-    # prioritize transaction by adding a prioritizer signature
-    if prioritizer_seed:
-        builder.sign(prioritizer_seed)
-
-    return builder.hash_hex(), builder.gen_xdr().decode()
+    The transaction is prioritized by adding a signature of given prioritizer index.
+    """
+    return (source, sequence,
+            [('payment', dest_address, payment_amount, None)],
+            [prioritizer] if prioritizer is not None else [])
 
 
 # all transactions are payments to the same address
 #
 # TODO can this potentially create deadlocks when applying them?
-async def generate_spam_round_tx_xdrs(pool, prioritizers: List[Keypair], prioritized_builders, unprioritized_builders, rnd):
-    """Generate transaction XDRs for a single spam round (ledger) according to given builders.
+async def generate_spam_round_tx_xdrs(pool: SigningPool, spam_kps: List[Keypair], spam_sequences, prioritizer_indexes, prioritized_spammers, unprioritized_spammers, rnd, chunk_size=None):
+    """Generate transaction XDRs for a single spam round (ledger) according to given spammer indexes.
 
-    Some of the generated transactions are prioritized using given prioritizer seeds,
+    Some of the generated transactions are prioritized using given prioritizer indexes,
     and some are unprioritized and not signed by a prioritizer account.
 
     All prioritized transactions are expected to be included in the next ledger.
     Only one out of all unprioritized transactions is expected to be included in the next ledger.
 
+    Transactions are signed in chunks of given size, see SigningPool.iter_sign().
+
     Return a metadata dictionary with the generated XDRs along with additional information.
     """
     logging.info('generating transaction xdrs for round %d', rnd)
 
-    # make a cyclic list of builders.
+    # make a cyclic list of spammers.
     # we will use this list to fetch a destination address for each payment tx,
-    # making all builders send a tx to the next builder right after them
+    # making all spammers send a tx to the next spammer right after them
     # in line in a cyclic manner. this is done in order to cycle through
     # destination addresses instead of sending call txs to a single destination
     # account.
-    cycl = itertools.cycle(unprioritized_builders)
-    next(cycl)  # make sure the next cycle call will return the next builder after the current one
+    cycl = itertools.cycle(unprioritized_spammers)
+    next(cycl)  # make sure the next cycle call will return the next spammer after the current one
 
     # generate unprioritized payment transactions
     # we generate them first, thus will submit them first,
     # because we want to test if prioritized transactions actually get priority over them
-    loop = asyncio.get_running_loop()
-    futurs = []
-    for builder in unprioritized_builders:
-        dest_address = next(cycl).keypair.address().decode()
-
-        f = loop.run_in_executor(
-            pool, build_and_sign,
-            builder, dest_address, PAYMENT_AMOUNT, None)
-        futurs.append(f)
-
-    if not futurs:
-        raise RuntimeError('no futures to gather')
-
-    tx_metadata = {}
-    for tx_hash, tx_xdr in await asyncio.gather(*futurs):
-        tx_metadata[tx_hash] = {'round': rnd, 'prioritized': False, 'xdr': tx_xdr}
+    jobs = []
+    for spammer in unprioritized_spammers:
+        dest_address = spam_kps[next(cycl)].public_address
+        jobs.append(payment_job(spammer, spam_sequences[spammer], dest_address, PAYMENT_AMOUNT))
 
     # generate prioritized transactions
-    futurs = []
-    cycl = itertools.cycle(prioritized_builders)
-    for builder, prioritizer in zip(prioritized_builders, prioritizers):
-        dest_address = next(cycl).keypair.address().decode()
+    cycl = itertools.cycle(prioritized_spammers)
+    for spammer, prioritizer in zip(prioritized_spammers, prioritizer_indexes):
+        dest_address = spam_kps[next(cycl)].public_address
+        jobs.append(payment_job(spammer, spam_sequences[spammer], dest_address, PAYMENT_AMOUNT, prioritizer))
 
-        f = loop.run_in_executor(
-            pool, build_and_sign,
-            builder, dest_address, PAYMENT_AMOUNT, prioritizer.secret_seed)
-        futurs.append(f)
+    if not jobs:
+        raise RuntimeError('no transactions to sign')
 
-    if not futurs:
-        raise RuntimeError('no futures to gather')
-
-    for tx_hash, tx_xdr in await asyncio.gather(*futurs):
-        tx_metadata[tx_hash] = {'round': rnd, 'prioritized': True, 'xdr': tx_xdr}
+    # sign all round transactions in chunks, results are returned in the same order
+    unprioritized_count = len(unprioritized_spammers)
+    tx_metadata = {}
+    for i, (tx_hash, tx_xdr) in enumerate(await pool.sign_many(jobs, chunk_size)):
+        tx_metadata[tx_hash] = {'round': rnd, 'prioritized': i >= unprioritized_count, 'xdr': tx_xdr}
 
     return tx_metadata
 
@@ -163,29 +158,29 @@ async def main():
     Environment(NETWORK_NAME, args.horizon[0], args.passphrase)
 
     logging.info('loading prioritizer accounts')
-    prioritizer_kps = [kp for kp in load_accounts(args.prioritizer_seeds_file)]
+    prioritizer_kps = open_accounts(args.prioritizer_seeds_file)
     logging.info('%d prioritizer accounts loaded', len(prioritizer_kps))
 
     logging.info('loading spammer accounts')
-    spam_kps = load_accounts(args.spammer_seeds_file)
+    spam_kps = open_accounts(args.spammer_seeds_file)
     logging.info('%d spammer accounts loaded', len(spam_kps))
 
     logging.info('fetching sequence number for spammer accounts')
-    spam_sequences = await get_sequences_multiple_endpoints(args.horizon, [kp.public_address for kp in spam_kps])
-
-    logging.info('generating spammer builders')
-    spam_builders = []
+    spam_addresses = [kp.public_address for kp in spam_kps]
+    if args.sequences_cache:
+        spam_sequences = await get_sequences_cached(args.horizon, spam_addresses, args.sequences_cache)
+    else:
+        spam_sequences = await get_sequences_multiple_endpoints(args.horizon, spam_addresses)
 
-    # we're not submitting using the builder - just generating the xdr,
-    # so each builder's horizon instance is irrelevant
-    stub_horizon = args.horizon[0]
-    for kp, seq in zip(spam_kps, spam_sequences):
-        b = Builder(NETWORK_NAME, stub_horizon, MIN_FEE, kp.secret_seed)
-        b.sequence = str(seq)
-        spam_builders.append(b)
+    # sign using worker processes holding all spammer and prioritizer seeds,
+    # where prioritizers follow spammers in the seed list
+    seeds = signing_seeds(spam_kps) + signing_seeds(prioritizer_kps)
+    prioritizer_indexes = list(range(len(spam_kps), len(seeds)))
 
     logging.info('generating spam transaction xdrs')
-    spam_rounds = await generate_spam_tx_xdrs(prioritizer_kps, spam_builders, args.length, args.txs_per_ledger, args.avg_block_time)
+    with SigningPool(NETWORK_NAME, MIN_FEE, seeds) as pool:
+        spam_rounds = await generate_spam_tx_xdrs(pool, spam_kps, spam_sequences, prioritizer_indexes,
+                                                  args.length, args.txs_per_ledger, args.avg_block_time, args.sign_chunk_size)
     logging.info('done generating spam transaction xdrs')
 
     logging.info('writing transaction xdrs to file %s', args.out)
@@ -56,10 +56,10 @@ def generate_keypairs(n) -> List[Keypair]:
     logging.info('generating %d keypairs', n)
 
     # split amounts of keypairs to create to multiple inputs,
-    # one for each cpu
+    # one for each cpu, spreading the remainder so no cpu does more than one extra keypair
     cpus = multiprocessing.cpu_count()
     d, m = n // cpus, n % cpus  # d[iv], m[od]
-    keypair_amounts = [d]*cpus + [m]*(1 if m else 0)
+    keypair_amounts = [d + 1]*m + [d]*(cpus - m)
 
     # generate keypairs across multiple cpus
     with concurrent.futures.ProcessPoolExecutor() as process_pool:
@@ -77,97 +77,6 @@ def generate_keypairs(n) -> List[Keypair]:
     return kps
 
 
-def _build_and_sign(source_kp, channel, kps, starting_balance):
-    for kp in kps:
-        channel.append_create_account_op(source=source_kp.public_address,
-                                         destination=kp.public_address,
-                                         starting_balance=str(starting_balance))
-
-    channel_seed = channel.keypair.seed().decode()
-    channel.sign(secret=channel_seed)
-    if channel_seed != source_kp.secret_seed:
-        channel.sign(secret=source_kp.secret_seed)
-
-    xdr = channel.gen_xdr().decode()
-    channel.clear()
-
-    return xdr
-
-
-async def channel_create_accounts(pool, session, queue, source_kp: Keypair, kps: List[Keypair], starting_balance, horizon_endpoint):
-    """Create MAX_OPS accounts in a single transaction using given channel and horizon endpoint."""
-    # get avaiable channel i.e. one which isn't currently in the process of submitting a tx
-    # and use it to async submit a single create account tx.
-    channel = await queue.get()
-    logging.debug('using channel %s to create accounts', channel)
-
-    # sign transaction with channel and source accounts,
-    # utilizing all availables cpus (tx signing is computationally intensive)
-    loop = asyncio.get_running_loop()
-    xdr = await loop.run_in_executor(pool, _build_and_sign, source_kp, channel, kps, starting_balance)
-
-    # submit tx
-    await post(session, '{}/transactions'.format(horizon_endpoint), {'tx': xdr}, [200])
-
-    # update sequence number
-    res = await get(
-        session,
-        '{}/accounts/{}'.format(horizon_endpoint, channel.keypair.address().decode()),
-        None,
-        [200])
-
-    channel.sequence = int(res['sequence'])
-
-    # make channel available for another transaction
-    await queue.put(channel)
-    logging.debug('channel %s finished submitting current create account transaction', channel)
-
-
-async def create_accounts(source_kp: Keypair, account_kps: List[Keypair], channel_builders: List[Builder], horizon_endpoints: List[str], starting_balance: int):
-    """Asynchronously create accounts and return a Keypair instance for each created account.
-
-    Accounts are created using given channel builders (as sequence number consumers)
-    and source keypair as funding source account.
-    """
-    logging.info('creating %d accounts', len(account_kps))
-
-    # generate txs, squeezing as much "create account" ops as possible to each one.
-    # when each tx is full with as much ops as it can include, sign and generate
-    # that tx's XDR.
-    # then, continue creating accounts using a new tx, and so on.
-    # we stop when we create all ops required according to given accounts_num.
-    def batch(iterable, n=1):
-        l = len(iterable)
-        for ndx in range(0, l, n):
-            yield iterable[ndx:min(ndx + n, l)]
-
-    # put channels in queue.
-    # each channel will be used to submit create account txs asynchronously,
-    # and will continue submitting more txs after he's done with the previous
-    # txs
-    channel_queue = asyncio.Queue()
-    for c in channel_builders:
-        await channel_queue.put(c)
-
-    with concurrent.futures.ProcessPoolExecutor() as process_pool:
-        async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=len(channel_builders))) as session:
-            futurs = []
-            for i, kp_batch in enumerate(batch(account_kps, MAX_OPS)):
-                coro = channel_create_accounts(
-                    process_pool, session, channel_queue, source_kp, kp_batch, starting_balance, horizon_endpoints[i % len(horizon_endpoints)])
-
-                futurs.append(asyncio.create_task(coro))
-
-            # wait for all remaining transactions to finish
-            await asyncio.gather(*futurs)
-
-    # sanity check: since all txs have already finished, all channels should be
-    # back in the queue
-    assert channel_queue.qsize() == len(channel_builders)
-
-    logging.info('created %d accounts', len(account_kps))
-
-
 async def get(session: aiohttp.ClientSession, url, req_params, expected_statuses: List[int]):
     """Send an HTTP GET request and return response JSON data.
 
@@ -261,38 +170,6 @@ async def send_txs(txs):
             return futurs
 
 
-async def get_sequences_multiple_endpoints(endpoints, addresses):
-    """Get sequence for multiple accounts, using one of given endpoints.
-
-    endpoints are iterated one after the other in a round robin manner.
-    """
-    logging.info('getting sequence for %d accounts', len(addresses))
-
-    async with LoggingClientSession() as session:
-        urls = ['{}/accounts'.format(e) for e in endpoints]
-        results = []
-        for i, address in enumerate(addresses):
-            # send request to one of the urls in a round robin manner
-            url = urls[i % len(urls)]
-            coro = get(session, '{}/{}'.format(url, address), None, [200])
-            results.append(coro)
-
-        results = await asyncio.gather(*results)
-
-    logging.info('finished getting sequence for %d accounts', len(addresses))
-
-    sequences = []
-    for r in results:
-        try:
-            seq = int(r['sequence'])
-        except KeyError:
-            # can occur if request failed
-            seq = 0
-        sequences.append(seq)
-
-    return sequences
-
-
 def get_latest_ledger(client):
     """Return latest ledger dictionary using given KinClient."""
     params = {'order': 'desc', 'limit': 1}
@@ -0,0 +1,75 @@
+"""HDR-style latency histogram with bounded relative error and memory."""
+import math
+
+
+class LatencyHistogram:
+    """Record latencies into log-linear buckets, similar to HdrHistogram.
+
+    Values are recorded in microseconds. Every power of two range is split into
+    2^(significant_bits-1) linear sub-buckets, so a recorded value is off by
+    at most 1/2^(significant_bits-1) of itself, regardless of its magnitude.
+    Buckets are kept sparsely, thus memory depends only on the spread of recorded values.
+    """
+
+    def __init__(self, significant_bits=8):
+        self.sub_bucket_bits = significant_bits
+        self.sub_bucket_half = 1 << (significant_bits - 1)
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        bucket = max(0, value.bit_length() - self.sub_bucket_bits)
+        return bucket * self.sub_bucket_half + (value >> bucket)
+
+    def _highest_equivalent_value(self, index):
+        bucket = max(0, index // self.sub_bucket_half - 1)
+        sub_bucket = index - bucket * self.sub_bucket_half
+        return ((sub_bucket + 1) << bucket) - 1
+
+    def record(self, seconds):
+        """Record given latency in seconds."""
+        value = max(0, int(seconds * 1e6))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Add all values recorded in given histogram to this one."""
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percentile):
+        """Return the latency in seconds at given percentile, e.g. 99.9."""
+        if not self.count:
+            return math.nan
+
+        rank = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._highest_equivalent_value(index), self.max) / 1e6
+
+        return self.max / 1e6
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """Return a dictionary of count, mean, max and given percentiles, in seconds."""
+        s = {'count': self.count,
+             'mean': self.total / self.count / 1e6 if self.count else math.nan,
+             'max': self.max / 1e6 if self.count else math.nan}
+        for p in percentiles:
+            s['p{}'.format(str(p).replace('.', ''))] = self.percentile(p)
+        return s
@@ -0,0 +1,199 @@
+"""Journal create account transaction submissions, so an interrupted account creation can be resumed.
+
+Journal format: newline-delimited JSON records of batch index, transaction hash, channel address and status,
+where status is 'submitted' right before a transaction is submitted, and 'applied' or 'failed' once its result is known.
+A timed out transaction is never recorded as failed, since it can still be applied later,
+so resuming checks it against Horizon.
+A batch is submitted again only if none of its transactions was applied.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import Counter
+from typing import Set
+
+import aiohttp
+
+from helpers import LoggingClientSession
+from ledger_fetcher import get_with_retry
+
+
+JOURNAL_CHECK_CONCURRENCY = 50  # concurrent requests per endpoint
+JOURNAL_CHECK_RETRIES = 5
+JOURNAL_CHECK_BACKOFF = 0.5
+JOURNAL_TAIL_SIZE = 4096  # bytes, longer than any record
+# horizon gives up waiting for a submitted transaction after three ledgers, while core can still apply it
+SETTLE_LEDGERS = 3
+SETTLE_POLL_INTERVAL = 1  # seconds
+
+
+class Journal:
+    """Append-only create account transaction journal file."""
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            trim_journal(path)
+        self.f = open(path, 'a')
+
+    def record(self, batch, tx_hash, channel, status):
+        """Append a record of given transaction status, flushing it so it survives the process dying."""
+        self.f.write(json.dumps({'batch': batch, 'hash': tx_hash, 'channel': channel, 'status': status}) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def trim_journal(path):
+    """Truncate an incomplete last record off given journal, left by a process that died while writing it.
+
+    Otherwise the next record would be appended to it, and both would be ignored when loading the journal.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - JOURNAL_TAIL_SIZE))
+        tail = f.read()
+    complete = size - len(tail) + tail.rfind(b'\n') + 1
+
+    if complete < size:
+        logging.warning('truncating incomplete last record of journal %s', path)
+        os.truncate(path, complete)
+
+
+def load_journal(path):
+    """Return applied batch indexes, and {transaction hash: (batch, channel)} of transactions with unknown results.
+
+    An incomplete last record, written by a process that died mid-write, is ignored.
+    """
+    applied = set()
+    unknown = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning('ignoring incomplete journal record %r', line)
+                continue
+
+            if record['status'] == 'submitted':
+                unknown[record['hash']] = (record['batch'], record['channel'])
+            else:
+                unknown.pop(record['hash'], None)
+                if record['status'] == 'applied':
+                    applied.add(record['batch'])
+
+    # transactions of applied batches needn't be checked
+    unknown = {h: (b, c) for h, (b, c) in unknown.items() if b not in applied}
+    return applied, unknown
+
+
+def applied_channel_batches(path) -> Counter:
+    """Return {channel address: amount of applied batches} of given journal."""
+    applied = Counter()
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['status'] == 'applied':
+                applied[record['channel']] += 1
+    return applied
+
+
+async def tx_exists(session: aiohttp.ClientSession, semaphores, endpoints, index, tx_hash, retries, backoff):
+    """Return True if given transaction was applied, False if Horizon doesn't know it.
+
+    The first request is sent to the endpoint at given index (modulo endpoint amount),
+    and every retry fails over to the next endpoint, after an exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        endpoint = endpoints[(index + attempt) % len(endpoints)]
+        try:
+            async with semaphores[endpoint], session.get('{}/transactions/{}'.format(endpoint, tx_hash)) as res:
+                if res.status == 200:
+                    return True
+                if res.status == 404:
+                    return False
+                error = 'HTTP {}'.format(res.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        if attempt == retries:
+            raise RuntimeError('Failed getting transaction {} after {} retries: {}'.format(tx_hash, retries, error))
+
+        # add jitter so concurrent requests failing together won't retry together
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        logging.warning('failed getting transaction %s from %s, retrying in %.1f seconds: %s', tx_hash, endpoint, delay, error)
+        await asyncio.sleep(delay)
+
+
+async def get_applied_txs(endpoints, tx_hashes, concurrency=JOURNAL_CHECK_CONCURRENCY,
+                          retries=JOURNAL_CHECK_RETRIES, backoff=JOURNAL_CHECK_BACKOFF) -> Set[str]:
+    """Return which of given transactions were applied, checking them concurrently using given endpoints.
+
+    endpoints are iterated one after the other in a round robin manner,
+    each serving up to given amount of concurrent requests.
+    """
+    logging.info('checking %d transactions', len(tx_hashes))
+
+    applied = set()
+    semaphores = {e: asyncio.Semaphore(concurrency) for e in endpoints}
+    pending = iter(enumerate(tx_hashes))
+
+    async def worker():
+        # workers share the pending iterator, so only a bounded amount of requests is in flight
+        for i, tx_hash in pending:
+            if await tx_exists(session, semaphores, endpoints, i, tx_hash, retries, backoff):
+                applied.add(tx_hash)
+
+    workers = min(len(tx_hashes), concurrency * len(endpoints))
+    async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=max(1, workers))) as session:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+
+    logging.info('%d/%d transactions were applied', len(applied), len(tx_hashes))
+    return applied
+
+
+async def wait_for_ledgers(endpoint, ledgers, interval=SETTLE_POLL_INTERVAL,
+                           retries=JOURNAL_CHECK_RETRIES, backoff=JOURNAL_CHECK_BACKOFF):
+    """Wait for given amount of ledgers to close, polling the latest ledger of given Horizon endpoint."""
+    async with LoggingClientSession() as session:
+        async def latest_ledger():
+            return (await get_with_retry(session, endpoint, None, retries, backoff))['history_latest_ledger']
+
+        target = await latest_ledger() + ledgers
+        logging.info('waiting for ledger %d', target)
+        while await latest_ledger() < target:
+            await asyncio.sleep(interval)
+
+
+async def resume_journal(path, endpoints, settle_ledgers=SETTLE_LEDGERS) -> Set[int]:
+    """Return created batch indexes of given journal, checking transactions with unknown results against Horizon.
+
+    A transaction submitted in the last few ledgers can still be applied, so given amount of ledgers
+    are waited for before checking, lest it be considered failed and its batch created twice.
+    Transactions found to be applied are recorded as such, so they aren't checked again on the next resume.
+    """
+    applied, unknown = load_journal(path)
+    logging.info('journal %s has %d created batches, and %d transactions with unknown results', path, len(applied), len(unknown))
+
+    found = set()
+    if unknown:
+        await wait_for_ledgers(endpoints[0], settle_ledgers)
+        found = await get_applied_txs(endpoints, list(unknown))
+    with Journal(path) as journal:
+        for tx_hash in found:
+            batch, channel = unknown[tx_hash]
+            journal.record(batch, tx_hash, channel, 'applied')
+            applied.add(batch)
+
+    return applied
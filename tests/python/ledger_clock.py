@@ -0,0 +1,269 @@
+"""Follow ledger closes on the network and schedule spam rounds according to them."""
+import asyncio
+import json
+import logging
+import random
+import time
+
+import aiohttp
+
+from helpers import get
+
+
+# weight of the latest close interval when updating the average close interval
+CLOSE_INTERVAL_WEIGHT = 0.2
+CLOSE_RETRIES = 10  # consecutive failed requests before giving up following ledger closes
+CLOSE_BACKOFF = 0.5
+CLOSE_MAX_BACKOFF = 10
+
+CLOSE_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError, KeyError, ValueError)
+
+
+async def retry_backoff(attempt, error, url):
+    """Sleep before retrying a failed ledger close request, or raise if given attempt was the last one."""
+    if attempt == CLOSE_RETRIES:
+        raise RuntimeError('Failed following ledger closes from {} after {} retries: {!r}'.format(url, CLOSE_RETRIES, error))
+
+    # add jitter so concurrent requests failing together won't retry together
+    delay = min(CLOSE_MAX_BACKOFF, CLOSE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.5)
+    logging.warning('failed following ledger closes from %s, retrying in %.1f seconds: %r', url, delay, error)
+    await asyncio.sleep(delay)
+
+
+async def horizon_ledger_closes(session: aiohttp.ClientSession, horizon_endpoint):
+    """Yield (ledger number, close time) for every closed ledger, streamed from Horizon using SSE.
+
+    Close time is the local time the ledger was received, since Horizon's closed_at has only a seconds resolution.
+    The stream is reopened from the last received ledger in case Horizon closes it or it fails,
+    with an exponential backoff following consecutive failures.
+    """
+    url = '{}/ledgers'.format(horizon_endpoint)
+    cursor = 'now'
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+    attempt = 0
+    while True:
+        try:
+            async with session.get(url, params={'cursor': cursor},
+                                   headers={'Accept': 'text/event-stream'}, timeout=timeout) as res:
+                if res.status != 200:
+                    raise RuntimeError('HTTP {}'.format(res.status))
+
+                async for line in res.content:
+                    line = line.decode().strip()
+                    if not line.startswith('data:'):
+                        continue
+
+                    # skip non-ledger messages e.g. "hello" sent when the stream is opened
+                    try:
+                        ledger = json.loads(line[len('data:'):])
+                    except ValueError:
+                        continue
+                    if not isinstance(ledger, dict) or 'sequence' not in ledger:
+                        continue
+
+                    attempt = 0
+                    cursor = ledger['paging_token']
+                    yield int(ledger['sequence']), time.time()
+        except CLOSE_ERRORS as e:
+            await retry_backoff(attempt, e, url)
+            attempt += 1
+            continue
+
+        logging.debug('horizon ledger stream closed, reopening from cursor %s', cursor)
+
+
+async def core_ledger_closes(session: aiohttp.ClientSession, core_endpoint, poll_interval):
+    """Yield (ledger number, close time) for every closed ledger, polling Core /info endpoint.
+
+    Close time is the local time the new ledger was noticed, thus its accuracy depends on given poll interval.
+    Failed polls are retried with an exponential backoff.
+    """
+    url = '{}/info'.format(core_endpoint)
+    last_ledger = None
+    attempt = 0
+    while True:
+        try:
+            res = await get(session, url, None, [200])
+            ledger = int(res['info']['ledger']['num'])
+        except CLOSE_ERRORS as e:
+            await retry_backoff(attempt, e, url)
+            attempt += 1
+            continue
+
+        attempt = 0
+        if last_ledger is not None and ledger > last_ledger:
+            yield ledger, time.time()
+
+        last_ledger = ledger
+        await asyncio.sleep(poll_interval)
+
+
+class LedgerClock:
+    """Track ledger closes from given (ledger number, close time) async iterator.
+
+    Callers can wait for a specific ledger to close and predict when the next ledger will close.
+    If following ledger closes fails, its error is raised to all waiters instead of leaving them waiting forever.
+    """
+
+    def __init__(self, closes):
+        self.closes = closes
+        self.close_times = {}
+        self.last_ledger = None
+        self.avg_close_interval = None
+        self._waiters = {}
+        self._next_waiters = []
+        self.error = None
+
+    async def run(self):
+        """Consume ledger closes until cancelled, or until following them fails."""
+        try:
+            async for ledger, close_time in self.closes:
+                self._on_close(ledger, close_time)
+            raise RuntimeError('ledger close stream ended')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error('following ledger closes failed: %r', e)
+            self._fail(e)
+
+    def _fail(self, error):
+        self.error = error
+        for fut in list(self._waiters.values()) + self._next_waiters:
+            if not fut.done():
+                fut.set_exception(error)
+        self._waiters = {}
+        self._next_waiters = []
+
+    def _on_close(self, ledger, close_time):
+        if self.last_ledger is not None:
+            if ledger <= self.last_ledger:
+                return
+
+            interval = (close_time - self.close_times[self.last_ledger]) / (ledger - self.last_ledger)
+            if self.avg_close_interval is None:
+                self.avg_close_interval = interval
+            else:
+                self.avg_close_interval += CLOSE_INTERVAL_WEIGHT * (interval - self.avg_close_interval)
+
+            # ledgers can be skipped when polling, so attribute their close to the ledger closing them
+            for skipped in range(self.last_ledger + 1, ledger):
+                self.close_times[skipped] = close_time
+
+        logging.debug('ledger %d closed', ledger)
+        self.close_times[ledger] = close_time
+        self.last_ledger = ledger
+
+        for n in [n for n in self._waiters if n <= ledger]:
+            self._waiters.pop(n).set_result(None)
+
+        for fut in self._next_waiters:
+            fut.set_result(None)
+        self._next_waiters = []
+
+    async def wait_for_ledger(self, ledger):
+        """Wait for given ledger number to close and return its close time."""
+        if self.last_ledger is None or ledger > self.last_ledger:
+            if self.error is not None:
+                raise self.error
+            if ledger not in self._waiters:
+                self._waiters[ledger] = asyncio.get_running_loop().create_future()
+            await self._waiters[ledger]
+
+        return self.close_times[ledger]
+
+    async def wait_for_next_ledger(self):
+        """Wait for the next ledger to close and return its number and close time."""
+        if self.error is not None:
+            raise self.error
+
+        fut = asyncio.get_running_loop().create_future()
+        self._next_waiters.append(fut)
+        await fut
+
+        return self.last_ledger, self.close_times[self.last_ledger]
+
+    def predict_close_time(self, ledger):
+        """Return the expected close time of given future ledger, based on the average close interval so far."""
+        interval = self.avg_close_interval or 0
+        return self.close_times[self.last_ledger] + (ledger - self.last_ledger) * interval
+
+
+class TimerSchedule:
+    """Schedule a spam round every fixed amount of seconds, according to given average block time."""
+
+    def __init__(self, avg_block_time, start=None):
+        self.avg_block_time = avg_block_time
+        self.start = start if start is not None else time.time()
+
+    async def wait_for_slot(self, rnd, lead_time=0):
+        """Wait until lead_time seconds before given round should be submitted."""
+        await asyncio.sleep(max(0, self.start + rnd * self.avg_block_time - lead_time - time.time()))
+
+    def is_late(self, rnd):
+        """Return True if given round's slot has already passed."""
+        return time.time() > self.start + rnd * self.avg_block_time
+
+    async def close_offset(self, rnd, submission_time):
+        """Return nothing, since rounds are not scheduled relative to ledger closes."""
+        return {}
+
+
+class LedgerSchedule:
+    """Schedule each spam round relative to an actual ledger close.
+
+    Round n is fired fire_offset seconds after the close of the n-th ledger following the schedule start.
+    A negative offset fires the round before the predicted close time of its ledger,
+    based on the average close interval observed so far.
+    """
+
+    def __init__(self, clock: LedgerClock, fire_offset=0):
+        self.clock = clock
+        self.fire_offset = fire_offset
+        self.first_ledger = None
+
+    async def start(self, lead_time=0):
+        """Wait for a ledger to close and start the schedule from the following ledger.
+
+        If rounds are fired (or loaded lead_time seconds) before ledger closes, wait for an additional ledger
+        so that close times can be predicted from the very first round, see wait_for_slot().
+        """
+        ledger, _ = await self.clock.wait_for_next_ledger()
+        if self.fire_offset - lead_time < 0:
+            ledger, _ = await self.clock.wait_for_next_ledger()
+
+        self.first_ledger = ledger + 1
+        logging.info('starting ledger schedule from ledger %d', self.first_ledger)
+
+    def target_ledger(self, rnd):
+        """Return the ledger whose close given round is scheduled by."""
+        return self.first_ledger + rnd
+
+    async def wait_for_slot(self, rnd, lead_time=0):
+        """Wait until lead_time seconds before given round should be submitted."""
+        target = self.target_ledger(rnd)
+        offset = self.fire_offset - lead_time
+        if offset >= 0:
+            close_time = await self.clock.wait_for_ledger(target)
+        else:
+            # fire before the target ledger closes: wait for the ledger preceding it to close,
+            # and estimate the target close time from there
+            await self.clock.wait_for_ledger(target - 1)
+            close_time = self.clock.predict_close_time(target)
+
+        await asyncio.sleep(max(0, close_time + offset - time.time()))
+
+    def is_late(self, rnd):
+        """Return True if the ledger following given round's target ledger has already closed."""
+        return self.clock.last_ledger is not None and self.clock.last_ledger > self.target_ledger(rnd)
+
+    async def close_offset(self, rnd, submission_time):
+        """Wait for given round's target ledger to close and return the submission time distance from it.
+
+        A negative offset means the round was submitted before the ledger closed (lead),
+        and a positive offset means it was submitted after it (lag).
+        """
+        target = self.target_ledger(rnd)
+        close_time = await self.clock.wait_for_ledger(target)
+        return {'target_ledger': target,
+                'ledger_close_time': close_time,
+                'close_offset': submission_time - close_time}
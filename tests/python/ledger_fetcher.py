@@ -0,0 +1,163 @@
+"""Fetch ledgers and their transactions from Horizon concurrently, caching them on disk.
+
+Closed ledgers never change, so each fetched ledger is saved to a local cache directory
+keyed by ledger number, and later runs over the same ledger range only fetch a single ledger header,
+verifying the cache belongs to the same network (see verify_cache()).
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+
+import aiohttp
+
+from helpers import LoggingClientSession
+
+
+MAX_RESULTS = 200  # horizon hardcoded limit
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# transaction record fields kept in cache, dropping large fields e.g. envelope and result xdrs
+TX_FIELDS = ('hash', 'ledger', 'created_at', 'source_account', 'fee_paid', 'operation_count', 'signatures')
+
+
+class LedgerCache:
+    """On-disk ledger cache, one JSON file per ledger number."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _ledger_path(self, ledger):
+        return os.path.join(self.path, '{}.json'.format(ledger))
+
+    def get(self, ledger):
+        """Return cached ledger, or None if it isn't cached."""
+        try:
+            with open(self._ledger_path(ledger)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, ledger, data):
+        """Save given ledger to cache."""
+        # write to a temporary file first so an interrupted run doesn't leave a partial ledger behind
+        path = self._ledger_path(ledger)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+
+async def get_with_retry(session: aiohttp.ClientSession, url, params, retries, backoff):
+    """Send an HTTP GET request and return response JSON data, retrying with exponential backoff on failure.
+
+    Fail if response is a non-retryable error status, or if all retries failed.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, params=params) as res:
+                if res.status == 200:
+                    return await res.json()
+                if res.status not in RETRY_STATUSES:
+                    logging.error('Error in HTTP GET request to %s: %s', url, await res.text())
+                    raise RuntimeError('Error in HTTP GET request to {}'.format(url))
+                error = 'HTTP {}'.format(res.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        if attempt == retries:
+            raise RuntimeError('Error in HTTP GET request to {} after {} retries: {}'.format(url, retries, error))
+
+        # add jitter so concurrent requests failing together won't retry together
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        logging.warning('%s in HTTP GET request to %s, retrying in %.1f seconds', error, url, delay)
+        await asyncio.sleep(delay)
+
+
+async def fetch_ledger(session: aiohttp.ClientSession, horizon_endpoint, ledger, retries, backoff):
+    """Return {'ledger': ledger record, 'transactions': [transaction records]} for given ledger number."""
+    logging.debug('fetching ledger %d', ledger)
+
+    header = await get_with_retry(session, '{}/ledgers/{}'.format(horizon_endpoint, ledger), None, retries, backoff)
+
+    url = '{}/ledgers/{}/transactions'.format(horizon_endpoint, ledger)
+    params = {'limit': MAX_RESULTS, 'order': 'asc'}
+    txs = []
+    while True:
+        res = await get_with_retry(session, url, params, retries, backoff)
+        records = res['_embedded']['records']
+        txs.extend({k: tx[k] for k in TX_FIELDS if k in tx} for tx in records)
+
+        # a partial page means there are no more transactions in this ledger
+        if len(records) < MAX_RESULTS:
+            break
+        params = {**params, 'cursor': records[-1]['paging_token']}
+
+    logging.debug('%d transactions found in ledger %d', len(txs), ledger)
+
+    return {'ledger': header, 'transactions': txs}
+
+
+async def verify_cache(session: aiohttp.ClientSession, horizon_endpoint, cached, retries, backoff):
+    """Return True if given cached ledgers belong to given Horizon's network, by comparing the latest one's hash.
+
+    Cached ledgers are stale e.g. after the test network was reset, or when fetching ledgers of another network.
+    """
+    ledger = max(cached)
+    url = '{}/ledgers/{}'.format(horizon_endpoint, ledger)
+    async with session.get(url) as res:
+        # a reset network may not have reached the cached ledger yet
+        if res.status == 404:
+            return False
+    header = await get_with_retry(session, url, None, retries, backoff)
+    return header.get('hash') is not None and header['hash'] == cached[ledger]['ledger'].get('hash')
+
+
+async def fetch_ledgers(horizon_endpoint, ledgers, cache_dir=None, concurrency=20, retries=5, backoff=0.5):
+    """Return a {ledger number: ledger} dictionary for given ledger numbers, see fetch_ledger().
+
+    Ledgers are read from given cache directory if it belongs to the same network as given Horizon.
+    Missing ledgers are fetched concurrently, using up to given amount of connections,
+    and are saved to cache if they are already closed.
+    """
+    cache = LedgerCache(cache_dir) if cache_dir else None
+
+    results = {}
+    missing = []
+    for n in ledgers:
+        cached = cache.get(n) if cache else None
+        if cached is not None:
+            results[n] = cached
+        else:
+            missing.append(n)
+
+    async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        if results and not await verify_cache(session, horizon_endpoint, results, retries, backoff):
+            logging.warning('ledger cache %s belongs to another network, fetching all ledgers', cache_dir)
+            missing = sorted(set(missing) | set(results))
+            results = {}
+
+        logging.info('%d ledgers found in cache, fetching %d ledgers', len(results), len(missing))
+        if not missing:
+            return results
+
+        root = await get_with_retry(session, '{}/'.format(horizon_endpoint), None, retries, backoff)
+        latest_ledger = int(root['history_latest_ledger'])
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(n):
+            async with semaphore:
+                ledger = await fetch_ledger(session, horizon_endpoint, n, retries, backoff)
+
+            if cache and n <= latest_ledger:
+                cache.put(n, ledger)
+            results[n] = ledger
+
+            if len(results) % 100 == 0:
+                logging.info('fetched %d ledgers', len(results))
+
+        await asyncio.gather(*[fetch(n) for n in missing])
+
+    return results
@@ -1,12 +1,11 @@
 """Print interesting ledger information for given ledger range."""
 import argparse
+import asyncio
 import json
 import logging
-import urllib.parse as urlparse
 from collections import defaultdict
 
-from kin.blockchain.horizon import Horizon
-from kin.config import SDK_USER_AGENT
+from ledger_fetcher import fetch_ledgers
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -19,51 +18,24 @@ def parse_args():
     parser.add_argument('--start-ledger', required=True, type=int, help='First ledger number to fetch transactions from')
     parser.add_argument('--end-ledger', required=True, type=int, help='Last ledger number to fetch transactions from')
     parser.add_argument('--horizon', required=True, type=str, help='Horizon endpoint URL')
+    parser.add_argument('--cache-dir', default='.ledger-cache', type=str, help='Ledger cache directory, use an empty value to disable caching')
+    parser.add_argument('--concurrency', default=20, type=int, help='Maximum amount of concurrent Horizon requests')
 
     return parser.parse_args()
 
 
-def ledger_transactions(ledger, horizon):
-    """Paginate and return a {hash: created_at} dictionary for all transactions in given ledger number."""
-    MAX_RESULTS = 200  # horizon hardcoded limit
-
-    logging.debug('fetching transactions for ledger %d', ledger)
-
-    def next_cursor(res):
-        url = res['_links']['next']['href']
-        p = urlparse.urlparse(url)
-        try:
-            return urlparse.parse_qs(p.query)['cursor'][0]
-        except KeyError:
-            # it looks like an empty cursor value points to 'the first page'
-            return ''
-
-    params = {'limit': MAX_RESULTS, 'order': 'asc'}
-    res = horizon.ledger_transactions(ledger, params=params)
-    txs = [tx for tx in res['_embedded']['records']]
-
-    # continue paginating only if there are any records returned
-    while res['_embedded']['records']:
-        res = horizon.ledger_transactions(ledger, params={**{'cursor': next_cursor(res)}, **params})
-        txs.extend([tx for tx in res['_embedded']['records']])
-
-    logging.debug('%d transactions found in ledger %d', len(txs), ledger)
-
-    return txs
-
-
 def main():
     args = parse_args()
 
     logging.info('fetching transactions for ledger range %d - %d', args.start_ledger, args.end_ledger)
 
-    horizon = Horizon(horizon_uri=args.horizon, user_agent=SDK_USER_AGENT)
+    # create {ledger num: {'ledger': ledger, 'transactions': [ledger txs]}} dictionary
+    ledgers = asyncio.run(fetch_ledgers(args.horizon, range(args.start_ledger, args.end_ledger + 1),
+                                        args.cache_dir, args.concurrency))
 
-    # create {ledger num: [ledger txs]} dictionary
-    ledgers = (ledger_transactions(n, horizon)
-               for n in range(args.start_ledger, args.end_ledger + 1))
+    for ledger_num in range(args.start_ledger, args.end_ledger + 1):
+        ledger_txs = ledgers[ledger_num]['transactions']
 
-    for ledger_num, ledger_txs in enumerate(ledgers, start=args.start_ledger):
         sig_count = defaultdict(lambda: 0)
         for tx in ledger_txs:
             num_sigs = len(tx['signatures'])
@@ -71,7 +43,7 @@ def main():
 
         ledger_info = {
             'ledger_number': ledger_num,
-            'max_tx_set_size': int(horizon.ledger(ledger_num)['max_tx_set_size']),
+            'max_tx_set_size': int(ledgers[ledger_num]['ledger']['max_tx_set_size']),
             'num_txs': len(ledger_txs),
             'tx_signature_count': sig_count,
         }
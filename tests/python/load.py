@@ -0,0 +1,233 @@
+"""Submit transactions at a constant target rate and measure sustained throughput and latency.
+
+Unlike stress.py, which bursts whole spam rounds at once, this is an open-loop load generator:
+transactions are sent according to a fixed arrival schedule regardless of how fast responses come back.
+Latency is measured from each transaction's intended send time rather than its actual send time,
+so time spent waiting for a free connection or a late event loop is counted (coordinated omission correction).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+import aiohttp
+
+from helpers import LoggingClientSession
+from histogram import LatencyHistogram
+from stress import iter_spam_rounds
+
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--xdrs-file', required=True, type=str, help='Transaction XDR list file, in JSON lines format (see gen_xdr.py)')
+    parser.add_argument('--out', default='load-results-{}.json'.format(str(int(time.time()))), type=str, help='Load results JSON output')
+    parser.add_argument('--endpoint', required=True, action='append',
+                        help='Endpoint URLs for submitting transactions (use multiple --endpoint flags for multiple addresses)')
+    parser.add_argument('--submit-to-core', action='store_true', help='Submit to Core instead of Horizon')
+
+    parser.add_argument('--rate', required=True, type=float, help='Target transactions per second')
+    parser.add_argument('--duration', required=True, type=float, help='Test length in seconds')
+    parser.add_argument('--arrivals', choices=['constant', 'poisson'], default='constant',
+                        help='Transaction arrival process: fixed intervals, or exponentially distributed intervals (Poisson)')
+    parser.add_argument('--max-inflight', type=int, default=5000, help='Maximum amount of concurrent requests')
+    parser.add_argument('--timeout', type=float, default=60, help='Request timeout in seconds')
+    parser.add_argument('--seed', type=int, help='Random seed for Poisson arrivals')
+
+    return parser.parse_args()
+
+
+def arrival_times(rate, duration, poisson, rng: random.Random):
+    """Yield intended send times in seconds from test start, for given rate and duration."""
+    t = 0
+    while t < duration:
+        yield t
+        t += rng.expovariate(rate) if poisson else 1 / rate
+
+
+def iter_xdrs(path):
+    """Yield transaction XDRs from given spam rounds file, one round at a time."""
+    for rnd in iter_spam_rounds(path):
+        for tx in rnd.values():
+            yield tx['xdr']
+
+
+class LoadStats:
+    """Latency histograms per endpoint and status."""
+
+    def __init__(self):
+        # latency from intended send time (corrected) and from actual send time (uncorrected)
+        self.corrected = defaultdict(LatencyHistogram)
+        self.uncorrected = defaultdict(LatencyHistogram)
+        self.sent = 0
+        self.first_send = None
+        self.last_response = None
+
+    def record(self, endpoint, status, intended, sent, received):
+        """Record a single request's latencies, given its intended send, actual send and response times."""
+        self.corrected[(endpoint, status)].record(received - intended)
+        self.uncorrected[(endpoint, status)].record(received - sent)
+        self.last_response = received if self.last_response is None else max(self.last_response, received)
+
+    def merged(self, histograms, key=lambda k: k):
+        """Merge given histograms grouped by given key function applied on (endpoint, status)."""
+        merged = defaultdict(LatencyHistogram)
+        for k, h in histograms.items():
+            merged[key(k)].merge(h)
+        return merged
+
+    def report(self):
+        """Return a results dictionary with throughput and latency percentiles per endpoint, per status and overall."""
+        elapsed = (self.last_response or 0) - (self.first_send or 0)
+        completed = sum(h.count for h in self.corrected.values())
+        ok = sum(h.count for (_, status), h in self.corrected.items() if status in ('200', 'PENDING'))
+
+        return {
+            'sent': self.sent,
+            'completed': completed,
+            'elapsed': elapsed,
+            'achieved_tps': completed / elapsed if elapsed > 0 else 0,
+            'successful_tps': ok / elapsed if elapsed > 0 else 0,
+            'overall': self.merged(self.corrected, lambda k: None)[None].summary(PERCENTILES),
+            'per_endpoint': {e: h.summary(PERCENTILES) for e, h in self.merged(self.corrected, lambda k: k[0]).items()},
+            'per_status': [{'endpoint': e, 'status': s,
+                            'latency': h.summary(PERCENTILES),
+                            # for comparison only, see module docstring
+                            'uncorrected_latency': self.uncorrected[(e, s)].summary(PERCENTILES)}
+                           for (e, s), h in sorted(self.corrected.items())],
+        }
+
+
+async def submit(session: aiohttp.ClientSession, inflight: asyncio.Semaphore, url, xdr, submit_to_horizon, intended, stats: LoadStats):
+    """Submit a single transaction XDR once an in-flight request slot is available, and record its latency and status."""
+    loop = asyncio.get_running_loop()
+    async with inflight:
+        sent = loop.time()
+        status = await send(session, url, xdr, submit_to_horizon)
+
+    stats.record(url, status, intended, sent, loop.time())
+
+
+async def send(session: aiohttp.ClientSession, url, xdr, submit_to_horizon):
+    """Send a single transaction XDR and return the response status."""
+    try:
+        if submit_to_horizon:
+            async with session.post(url, data={'tx': xdr}) as res:
+                await res.read()
+                status = str(res.status)
+        else:  # submit to core
+            async with session.get(url, params={'blob': xdr}) as res:
+                res_data = await res.json(content_type=None)
+                status = res_data.get('status', str(res.status)) if isinstance(res_data, dict) else str(res.status)
+    except asyncio.TimeoutError:
+        status = 'timeout'
+    except (aiohttp.ClientError, ValueError) as e:
+        status = type(e).__name__
+
+    return status
+
+
+async def generate_load(endpoints, submit_to_horizon, xdrs, rate, duration, poisson, max_inflight, timeout, rng):
+    """Submit given transaction XDRs according to an open-loop arrival schedule and return load statistics.
+
+    Endpoints are iterated one after the other in a round robin manner.
+    """
+    if submit_to_horizon:
+        urls = ['{}/transactions'.format(e) for e in endpoints]
+    else:  # submit to core
+        urls = ['{}/tx'.format(e) for e in endpoints]
+
+    stats = LoadStats()
+    loop = asyncio.get_running_loop()
+    inflight = asyncio.Semaphore(max_inflight)
+    connector = aiohttp.TCPConnector(limit=max_inflight)
+    async with LoggingClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = loop.time()
+        stats.first_send = start
+
+        futurs = set()
+        for i, t in enumerate(arrival_times(rate, duration, poisson, rng)):
+            xdr = next(xdrs, None)
+            if xdr is None:
+                logging.warning('ran out of transaction xdrs after %d transactions', stats.sent)
+                break
+
+            # requests which are due are all sent when the loop wakes up,
+            # and their latency is measured from the time they were due
+            intended = start + t
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            f = asyncio.create_task(submit(session, inflight, urls[i % len(urls)], xdr, submit_to_horizon, intended, stats))
+            futurs.add(f)
+            f.add_done_callback(futurs.discard)
+            stats.sent += 1
+
+            if stats.sent % 10000 == 0:
+                logging.info('sent %d transactions, %d in flight', stats.sent, len(futurs))
+
+        logging.info('done sending %d transactions, waiting for %d in-flight requests', stats.sent, len(futurs))
+        await asyncio.gather(*futurs)
+
+    return stats
+
+
+def print_report(report):
+    """Print throughput and latency percentiles in milliseconds."""
+    print('sent {sent} completed {completed} in {elapsed:.1f}s: '
+          'achieved {achieved_tps:.1f} tps, successful {successful_tps:.1f} tps'.format(**report))
+
+    header = '{:<40} {:>10} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}'
+    row = '{:<40} {:>10} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'
+    print(header.format('endpoint', 'status', 'count', 'p50', 'p90', 'p99', 'p999', 'max'))
+
+    def print_row(endpoint, status, s):
+        print(row.format(endpoint, status, s['count'],
+                         *(s[k] * 1000 for k in ('p50', 'p90', 'p99', 'p999', 'max'))))
+
+    for s in report['per_status']:
+        print_row(s['endpoint'], s['status'], s['latency'])
+    for endpoint, s in sorted(report['per_endpoint'].items()):
+        print_row(endpoint, 'all', s)
+    print_row('all', 'all', report['overall'])
+
+
+async def main():
+    """Submit transactions at the target rate, then print and save throughput and latency results."""
+    args = parse_args()
+
+    logging.info('submitting %.1f transactions per second for %.1f seconds', args.rate, args.duration)
+    stats = await generate_load(
+        args.endpoint,
+        submit_to_horizon=(not args.submit_to_core),
+        xdrs=iter_xdrs(args.xdrs_file),
+        rate=args.rate,
+        duration=args.duration,
+        poisson=(args.arrivals == 'poisson'),
+        max_inflight=args.max_inflight,
+        timeout=args.timeout,
+        rng=random.Random(args.seed))
+
+    report = stats.report()
+    print_report(report)
+
+    logging.info('writing load results to file %s', args.out)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=True)
+
+    logging.info('done')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
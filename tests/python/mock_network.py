@@ -0,0 +1,239 @@
+"""Local stand-in for Horizon and Core HTTP APIs, for benchmarking the load test tools without a real network.
+
+Submitted transactions are added to the next ledger to close, where ledgers close every fixed interval,
+and can then be fetched back from ledger endpoints the same as from Horizon.
+Like Core, a transaction is rejected unless its sequence number follows its source account's current one,
+and accounts merged into another account no longer exist.
+Every request is delayed by a configurable latency, and fails at a configurable error rate.
+Like Horizon, a timed out transaction submission may still be applied, up to a couple of ledgers later.
+
+Horizon endpoints: /, /transactions, /transactions/{hash}, /accounts/{id}, /ledgers/{n}, /ledgers/{n}/transactions
+Core endpoints: /tx, /info
+"""
+import argparse
+import asyncio
+import binascii
+import hashlib
+import logging
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import unquote
+
+from aiohttp import web
+from kin_base.network import Network
+from kin_base.operation import AccountMerge
+from kin_base.transaction_envelope import TransactionEnvelope
+
+from ledger_fetcher import MAX_RESULTS
+
+
+GENESIS_LEDGER = 1
+MAX_TX_SET_SIZE = 500
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+
+def parse_args():
+    """Generate and parse CLI arguments."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--host', default='127.0.0.1', type=str, help='Listen address')
+    parser.add_argument('--port', default=8000, type=int, help='Listen port')
+    parser.add_argument('--passphrase', required=True, type=str, help='Network passphrase, used for calculating transaction hashes')
+    parser.add_argument('--latency', default=0, type=float, help='Seconds to delay every response')
+    parser.add_argument('--error-rate', default=0, type=float, help='Share of failed requests, between 0 and 1')
+    parser.add_argument('--ledger-interval', default=5, type=float, help='Seconds between ledger closes')
+
+    return parser.parse_args()
+
+
+def timestamp(t):
+    """Return given epoch time formatted as a Horizon UTC timestamp."""
+    return datetime.fromtimestamp(int(t), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def problem(status, title, extras=None):
+    """Return a Horizon problem JSON response."""
+    return web.json_response({'type': 'mock_error', 'title': title, 'status': status, 'extras': extras or {}}, status=status)
+
+
+class MockNetwork:
+    """Mock Horizon and Core state and request handlers."""
+
+    def __init__(self, passphrase, latency=0, error_rate=0, ledger_interval=5, rng=None):
+        self.network_id = Network(passphrase).network_id()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ledger_interval = ledger_interval
+        self.rng = rng or random.Random()
+
+        self.start = time.time()
+        self.ledger_txs = defaultdict(list)
+        self.txs = {}  # {hash: transaction record}
+        self.sequences = {}
+        self.merged = set()  # merged account addresses
+
+    def latest_ledger(self):
+        """Return the latest closed ledger number."""
+        return GENESIS_LEDGER + int((time.time() - self.start) / self.ledger_interval)
+
+    def close_time(self, ledger):
+        return self.start + (ledger - GENESIS_LEDGER) * self.ledger_interval
+
+    def ledger_hash(self, ledger):
+        # ledger hashes differ between mock networks started at different times, as between reset networks
+        return hashlib.sha256('{}:{}:{}'.format(self.network_id.hex(), self.start, ledger).encode()).hexdigest()
+
+    def add_tx(self, xdr):
+        """Add given transaction envelope XDR to the next ledger, and return transaction hash and ledger number.
+
+        Return None instead if the transaction sequence number doesn't follow its source account's current one,
+        or if its source account was merged.
+        """
+        te = TransactionEnvelope.from_xdr(xdr)
+        source = te.tx.source.decode() if isinstance(te.tx.source, bytes) else te.tx.source
+        if source in self.merged or te.tx.sequence != self.sequences.get(source, 0) + 1:
+            return None
+
+        te.network_id = self.network_id
+        tx_hash = binascii.hexlify(te.hash_meta()).decode()
+
+        ledger = self.latest_ledger() + 1
+        self.txs[tx_hash] = {
+            'hash': tx_hash,
+            'ledger': ledger,
+            'source_account': source,
+            'fee_paid': te.tx.fee,
+            'operation_count': len(te.tx.operations),
+            'signatures': [binascii.b2a_base64(s.signature, newline=False).decode() for s in te.signatures],
+        }
+        self.ledger_txs[ledger].append(self.txs[tx_hash])
+        self.sequences[source] = te.tx.sequence
+        for op in te.tx.operations:
+            if isinstance(op, AccountMerge):
+                merged = op.source or source
+                self.merged.add(merged.decode() if isinstance(merged, bytes) else merged)
+
+        return tx_hash, ledger
+
+    async def delay(self):
+        """Delay response according to configured latency, and return True if request should fail."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.rng.random() < self.error_rate
+
+    async def root(self, request):
+        if await self.delay():
+            return problem(500, 'Internal Server Error')
+        return web.json_response({'history_latest_ledger': self.latest_ledger()})
+
+    async def submit_horizon(self, request):
+        data = await request.post()
+        if await self.delay():
+            if self.rng.random() < 0.5:
+                asyncio.get_event_loop().call_later(self.rng.uniform(0, 2 * self.ledger_interval), self.add_tx, data['tx'])
+            return problem(504, 'Timeout')
+
+        added = self.add_tx(data['tx'])
+        if added is None:
+            return problem(400, 'Transaction Failed', {'result_codes': {'transaction': 'tx_bad_seq'}})
+
+        tx_hash, ledger = added
+        return web.json_response({'hash': tx_hash, 'ledger': ledger})
+
+    async def transaction(self, request):
+        if await self.delay():
+            return problem(500, 'Internal Server Error')
+
+        # a transaction is known only once its ledger closed
+        tx = self.txs.get(request.match_info['hash'])
+        if tx is None or tx['ledger'] > self.latest_ledger():
+            return problem(404, 'Resource Missing')
+        return web.json_response(tx)
+
+    async def account(self, request):
+        if await self.delay():
+            return problem(500, 'Internal Server Error')
+
+        address = request.match_info['address']
+        if address in self.merged:
+            return problem(404, 'Resource Missing')
+        return web.json_response({'id': address, 'sequence': str(self.sequences.get(address, 0))})
+
+    async def ledger(self, request):
+        if await self.delay():
+            return problem(500, 'Internal Server Error')
+
+        ledger = int(request.match_info['ledger'])
+        if ledger > self.latest_ledger():
+            return problem(404, 'Resource Missing')
+
+        return web.json_response({
+            'sequence': ledger,
+            'hash': self.ledger_hash(ledger),
+            'paging_token': str(ledger),
+            'closed_at': timestamp(self.close_time(ledger)),
+            'transaction_count': len(self.ledger_txs.get(ledger, [])),
+            'max_tx_set_size': MAX_TX_SET_SIZE,
+        })
+
+    async def ledger_transactions(self, request):
+        if await self.delay():
+            return problem(500, 'Internal Server Error')
+
+        ledger = int(request.match_info['ledger'])
+        if ledger > self.latest_ledger():
+            return problem(404, 'Resource Missing')
+
+        # paging token is the transaction index in its ledger
+        limit = min(int(request.query.get('limit', 10)), MAX_RESULTS)
+        cursor = int(request.query.get('cursor', -1))
+        txs = self.ledger_txs.get(ledger, [])[cursor + 1:cursor + 1 + limit]
+
+        created_at = timestamp(self.close_time(ledger))
+        records = [{**tx, 'created_at': created_at, 'paging_token': str(cursor + 1 + i)} for i, tx in enumerate(txs)]
+        return web.json_response({'_embedded': {'records': records}})
+
+    async def submit_core(self, request):
+        # some aiohttp versions don't unquote query values, and unquoting base64 is otherwise harmless
+        blob = unquote(request.query['blob'])
+        if await self.delay():
+            return web.json_response({'status': 'ERROR', 'error': 'AAAAAAAAAAD////7AAAAAA=='})
+
+        if self.add_tx(blob) is None:
+            return web.json_response({'status': 'ERROR', 'error': 'AAAAAAAAAAD////7AAAAAA=='})
+        return web.json_response({'status': 'PENDING'})
+
+    async def info(self, request):
+        if await self.delay():
+            return web.json_response({'info': {'state': 'Catching up'}}, status=500)
+
+        ledger = self.latest_ledger()
+        return web.json_response({'info': {'state': 'Synced!',
+                                           'ledger': {'num': ledger, 'closeTime': int(self.close_time(ledger))}}})
+
+    def app(self):
+        """Return an aiohttp application serving all mock endpoints."""
+        app = web.Application()
+        app.router.add_get('/', self.root)
+        app.router.add_post('/transactions', self.submit_horizon)
+        app.router.add_get('/transactions/{hash}', self.transaction)
+        app.router.add_get('/accounts/{address}', self.account)
+        app.router.add_get('/ledgers/{ledger}', self.ledger)
+        app.router.add_get('/ledgers/{ledger}/transactions', self.ledger_transactions)
+        app.router.add_get('/tx', self.submit_core)
+        app.router.add_get('/info', self.info)
+        return app
+
+
+def main():
+    args = parse_args()
+    network = MockNetwork(args.passphrase, args.latency, args.error_rate, args.ledger_interval)
+    web.run_app(network.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 import argparse
+import asyncio
 import csv
 import json
 import logging
+import math
 import time
-import urllib.parse as urlparse
-from datetime import datetime
+from datetime import datetime, timezone
 
-from kin.blockchain.horizon import Horizon
-from kin.config import SDK_USER_AGENT
+import numpy as np
+
+import columnar
+from ledger_fetcher import fetch_ledgers
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -20,69 +23,86 @@ def parse_args():
     parser.add_argument('--start-ledger', required=True, type=int, help='First ledger number to fetch transactions from')
     parser.add_argument('--end-ledger', required=True, type=int, help='Last ledger number to fetch transactions from')
 
-    parser.add_argument('--input', required=True, type=str, help='Spam results JSON output')
-    parser.add_argument('--output', default='spam-results-{}.csv'.format(str(int(time.time()))), type=str, help='Spam results CSV output')
+    parser.add_argument('--input', required=True, type=str, help='Spam results output, in JSON lines or columnar (.npy) format')
+    parser.add_argument('--output', default='spam-results-{}.csv'.format(str(int(time.time()))), type=str,
+                        help='Spam results report output, CSV or columnar (.npy, columnar input only)')
 
     parser.add_argument('--horizon', required=True, type=str, help='Horizon endpoint URL')
+    parser.add_argument('--cache-dir', default='.ledger-cache', type=str, help='Ledger cache directory, use an empty value to disable caching')
+    parser.add_argument('--concurrency', default=20, type=int, help='Maximum amount of concurrent Horizon requests')
 
     return parser.parse_args()
 
 
-def ledger_transactions_created_at(ledger, horizon):
-    """Paginate and return a {hash: created_at} dictionary for all transactions in given ledger number."""
-    MAX_RESULTS = 200  # horizon hardcoded limit
+def ledger_close_times(ledgers):
+    """Return arrays of all transaction hashes in given ledgers, sorted, and their matching ledger close times."""
+    txs = [tx for ledger in ledgers.values() for tx in ledger['transactions']]
+    hashes = np.array([tx['hash'] for tx in txs], dtype='S64')
 
-    logging.debug('fetching transactions for ledger %d', ledger)
+    # created_at is a UTC timestamp e.g. 2019-01-01T00:00:00Z
+    created_at = np.array([tx['created_at'].rstrip('Z') for tx in txs], dtype='datetime64[s]').astype('f8')
 
-    def next_cursor(res):
-        url = res['_links']['next']['href']
-        p = urlparse.urlparse(url)
-        try:
-            return urlparse.parse_qs(p.query)['cursor'][0]
-        except KeyError:
-            # it looks like an empty cursor value points to 'the first page'
-            return ''
+    order = np.argsort(hashes)
+    return hashes[order], created_at[order]
 
-    def tx_dict_from_results(res):
-        txs_created_at = {}
-        for tx in res['_embedded']['records']:
-            txs_created_at[tx['hash']] = tx['created_at']
-        return txs_created_at
 
-    params = {'limit': MAX_RESULTS, 'order': 'asc'}
-    res = horizon.ledger_transactions(ledger, params=params)
+def join_ledger_time(results, hashes, close_times):
+    """Return the ledger close time of every transaction result, or NaN for transactions not found in given sorted hashes."""
+    if not len(hashes):
+        return np.full(len(results), np.nan)
 
-    txs_created_at = {}
-    txs_created_at.update(tx_dict_from_results(res))
+    idx = np.searchsorted(hashes, results['hash'])
+    idx[idx == len(hashes)] = 0
+    found = hashes[idx] == results['hash']
+    return np.where(found, close_times[idx], np.nan)
 
-    # continue paginating only if there are any records returned
-    while res['_embedded']['records']:
-        res = horizon.ledger_transactions(ledger, params={**{'cursor': next_cursor(res)}, **params})
-        txs_created_at.update(tx_dict_from_results(res))
 
-    logging.debug('%d transactions found in ledger %d', len(txs_created_at), ledger)
+def columnar_report(results, ledgers, output):
+    """Add ledger close time to given columnar spam results and save report, in columnar format or as CSV."""
+    hashes, close_times = ledger_close_times(ledgers)
 
-    return txs_created_at
+    report = np.empty(len(results), dtype=[d for d in results.dtype.descr if d[0] != 'ledger_time'] + [('ledger_time', 'f8')])
+    for name in results.dtype.names:
+        report[name] = results[name]
+    report['ledger_time'] = join_ledger_time(results, hashes, close_times)
 
+    if columnar.is_columnar(output):
+        columnar.save(output, report)
+        return
 
-def main():
-    args = parse_args()
+    columns = []
+    for name in report.dtype.names:
+        column = report[name]
+        if column.dtype.kind == 'S':
+            column = np.char.decode(column)
+        column = column.tolist()
+        # write missing values as empty fields
+        if report.dtype[name].kind == 'f':
+            column = ['' if math.isnan(v) else v for v in column]
+        elif name in columnar.LEDGER_FIELDS:
+            column = ['' if v == columnar.MISSING_VALUES['i'] else v for v in column]
+        columns.append(column)
 
-    logging.info('fetching transactions for ledgers %d to %d', args.start_ledger, args.end_ledger)
+    with open(output, 'w') as csvfile:
+        w = csv.writer(csvfile)
+        w.writerow(report.dtype.names)
+        w.writerows(zip(*columns))
 
-    horizon = Horizon(horizon_uri=args.horizon, user_agent=SDK_USER_AGENT)
-    txs_created_at = {}
-    for ledger in range(args.start_ledger, args.end_ledger + 1):
-        txs_created_at.update(ledger_transactions_created_at(ledger, horizon))
+
+def json_report(results_path, ledgers, output):
+    """Add ledger close time to given spam results file in JSON lines format and save report as CSV."""
+    # create {hash: created_at} dictionary for all transactions in fetched ledgers
+    txs_created_at = {tx['hash']: tx['created_at']
+                      for ledger in ledgers.values()
+                      for tx in ledger['transactions']}
 
     logging.info('reading spam results')
     results = []
-    with open(args.input) as f:
+    with open(results_path) as f:
         for l in f:
             results.append(json.loads(l))
 
-    logging.info('generating report csv and saving to %s', args.output)
-    with open(args.output, 'w') as csvfile:
+    with open(output, 'w') as csvfile:
         w = csv.DictWriter(csvfile, fieldnames=list(results[0].keys()) + ['ledger_time'])
         w.writeheader()
         for i, tx in enumerate(results):
@@ -91,12 +111,29 @@ def main():
 
             hsh = tx['hash']
             try:
-                tx['ledger_time'] = datetime.strptime(txs_created_at[hsh], '%Y-%m-%dT%H:%M:%SZ').timestamp()
+                # created_at is a UTC timestamp, which strptime() doesn't know
+                created_at = datetime.strptime(txs_created_at[hsh], '%Y-%m-%dT%H:%M:%SZ')
+                tx['ledger_time'] = created_at.replace(tzinfo=timezone.utc).timestamp()
             except KeyError:  # meaning tx wasn't in any ledger that was fetched
                 tx['ledger_time'] = ''
 
             w.writerow(tx)
 
+
+def main():
+    args = parse_args()
+
+    logging.info('fetching transactions for ledgers %d to %d', args.start_ledger, args.end_ledger)
+
+    ledgers = asyncio.run(fetch_ledgers(args.horizon, range(args.start_ledger, args.end_ledger + 1),
+                                        args.cache_dir, args.concurrency))
+
+    logging.info('generating report and saving to %s', args.output)
+    if columnar.is_columnar(args.input):
+        columnar_report(columnar.load(args.input), ledgers, args.output)
+    else:
+        json_report(args.input, ledgers, args.output)
+
     logging.info('done')
 
 
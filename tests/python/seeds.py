@@ -0,0 +1,250 @@
+"""Generate, store and load account seeds without deriving keypairs up front.
+
+Accounts are kept as raw records of a 32-byte seed followed by its 32-byte public key,
+so their seed and address are available without ed25519 key derivation.
+
+Workers generating accounts return raw records instead of pickled Keypair objects,
+and batches are yielded as soon as they are generated, so early batches can be written to a seeds file
+and funded while later batches are still being generated.
+
+Binary seed store format: SEED_STORE_MAGIC followed by fixed-width raw records,
+which is memory-mapped and accessed by index or slice, see SeedStore.
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import math
+import mmap
+import os
+from collections import deque
+from typing import List
+
+from kin import Keypair
+from kin_base.keypair import Keypair as BaseKeypair
+from kin_base.utils import encode_check
+
+from helpers import load_accounts
+
+
+SEED_BATCH_SIZE = 10000
+RAW_KEY_SIZE = 32
+RECORD_SIZE = 2 * RAW_KEY_SIZE
+SEED_STORE_MAGIC = b'KINSEED1'
+
+
+class Account:
+    """Account of a raw record, exposing the same seed and address attributes as kin.Keypair.
+
+    Seed and address are encoded only when accessed, and a keypair is derived only if needed for signing.
+    """
+
+    __slots__ = ('raw',)
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+
+    @property
+    def secret_seed(self):
+        return encode_check('seed', self.raw[:RAW_KEY_SIZE]).decode()
+
+    @property
+    def public_address(self):
+        return encode_check('account', self.raw[RAW_KEY_SIZE:]).decode()
+
+    def keypair(self) -> Keypair:
+        """Return a kin.Keypair of this account, deriving its signing key."""
+        return Keypair(self.secret_seed)
+
+
+def raw_accounts(n) -> bytes:
+    """Return given amount of random raw records."""
+    out = bytearray()
+    for _ in range(n):
+        kp = BaseKeypair.random()
+        out += kp.raw_seed() + kp.raw_public_key()
+    return bytes(out)
+
+
+def raw_accounts_from_seeds(seeds: List[str]) -> bytes:
+    """Return raw records of given seeds."""
+    out = bytearray()
+    for seed in seeds:
+        kp = BaseKeypair.from_seed(seed)
+        out += kp.raw_seed() + kp.raw_public_key()
+    return bytes(out)
+
+
+def decode_accounts(raw: bytes) -> List[Account]:
+    """Return accounts of given raw records."""
+    return [Account(raw[i:i + RECORD_SIZE]) for i in range(0, len(raw), RECORD_SIZE)]
+
+
+def pool_imap(pool: concurrent.futures.Executor, f, args, window):
+    """Yield results of calling given function on every argument in given pool, in order.
+
+    Only up to given amount of calls is pending at once, so results don't pile up in memory ahead of the consumer.
+    """
+    args = iter(args)
+    pending = deque(pool.submit(f, a) for a in itertools.islice(args, window))
+    while pending:
+        res = pending.popleft().result()
+        for a in itertools.islice(args, 1):
+            pending.append(pool.submit(f, a))
+        yield res
+
+
+def batch_sizes(n, batch_size, workers) -> List[int]:
+    """Split given amount into batches of up to given size, of even sizes and at least one batch per worker."""
+    batches = min(n, max(workers, math.ceil(n / batch_size)))
+    return [n // batches + (1 if i < n % batches else 0) for i in range(batches)]
+
+
+def iter_account_batches(n, batch_size=SEED_BATCH_SIZE, workers=None):
+    """Generate given amount of accounts using all available CPUs, and yield them in batches, in order.
+
+    Only a few batches per worker are generated ahead of the consumer, so memory use doesn't grow with amount.
+    """
+    workers = workers or os.cpu_count()
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        generated = 0
+        for raw in pool_imap(pool, raw_accounts, batch_sizes(n, batch_size, workers), 2 * workers):
+            batch = decode_accounts(raw)
+            generated += len(batch)
+            logging.info('generated %d/%d accounts', generated, n)
+            yield batch
+
+
+async def stream_batches(batches):
+    """Asynchronously yield batches of given batch iterator, which is run in a thread to not block the event loop."""
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as thread:
+        while True:
+            batch = await loop.run_in_executor(thread, next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+
+async def stream_account_batches(n, batch_size=SEED_BATCH_SIZE, workers=None):
+    """Asynchronously yield account batches of iter_account_batches(), see stream_batches()."""
+    async for batch in stream_batches(iter_account_batches(n, batch_size, workers)):
+        yield batch
+
+
+def write_seeds(f, accounts):
+    """Write seeds of given accounts to given file, in the newline-delimited format read by helpers.load_accounts()."""
+    f.write(''.join('{}\n'.format(a.secret_seed) for a in accounts))
+
+
+def write_raw_accounts(f, accounts: List[Account]):
+    """Write raw records of given accounts to given binary seed store file, following its header."""
+    if f.tell() == 0:
+        f.write(SEED_STORE_MAGIC)
+    f.write(b''.join(a.raw for a in accounts))
+
+
+class SeedStore:
+    """Memory-mapped binary seed store, accessed by index or slice.
+
+    Only accessed records are read, and no keypair is derived, see Account.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.mmap[:len(SEED_STORE_MAGIC)] != SEED_STORE_MAGIC:
+            raise ValueError('{} is not a binary seed store'.format(path))
+        if (len(self.mmap) - len(SEED_STORE_MAGIC)) % RECORD_SIZE:
+            raise ValueError('{} is truncated'.format(path))
+
+    def __len__(self):
+        return (len(self.mmap) - len(SEED_STORE_MAGIC)) // RECORD_SIZE
+
+    def _record(self, i):
+        offset = len(SEED_STORE_MAGIC) + i * RECORD_SIZE
+        return self.mmap[offset:offset + RECORD_SIZE]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Account(self._record(i)) for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('seed store index out of range')
+        return Account(self._record(index))
+
+    def __iter__(self):
+        return (Account(self._record(i)) for i in range(len(self)))
+
+    def raw_seeds(self) -> List[bytes]:
+        """Return raw seeds of all accounts, e.g. for a SigningPool."""
+        return [self._record(i)[:RAW_KEY_SIZE] for i in range(len(self))]
+
+    def close(self):
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_seed_store(path):
+    """Return True if given file is a binary seed store, rather than a text seeds file."""
+    with open(path, 'rb') as f:
+        return f.read(len(SEED_STORE_MAGIC)) == SEED_STORE_MAGIC
+
+
+def iter_seed_file_batches(path, batch_size=SEED_BATCH_SIZE, workers=None):
+    """Yield accounts of given seeds file in batches, in order.
+
+    Accounts of a text seeds file are decoded using all available CPUs, see iter_account_batches().
+    """
+    if is_seed_store(path):
+        with SeedStore(path) as store:
+            for i in range(0, len(store), batch_size):
+                yield store[i:i + batch_size]
+        return
+
+    workers = workers or os.cpu_count()
+    with open(path) as f, concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        seeds = (line.strip() for line in f if line.strip())
+        chunks = iter(lambda: list(itertools.islice(seeds, batch_size)), [])
+        for raw in pool_imap(pool, raw_accounts_from_seeds, chunks, 2 * workers):
+            yield decode_accounts(raw)
+
+
+def trim_seeds_file(path):
+    """Truncate an incomplete last record off given seeds file, left by a process that died while writing it."""
+    size = os.path.getsize(path)
+    if is_seed_store(path):
+        complete = size - (size - len(SEED_STORE_MAGIC)) % RECORD_SIZE
+    else:
+        # a text seed is shorter than a record, so a complete line ends in the last record-sized tail
+        with open(path, 'rb') as f:
+            f.seek(max(0, size - 2 * RECORD_SIZE))
+            tail = f.read()
+        complete = size - len(tail) + tail.rfind(b'\n') + 1
+
+    if complete < size:
+        logging.warning('truncating incomplete last record of seeds file %s', path)
+        os.truncate(path, complete)
+
+
+def open_accounts(path):
+    """Return accounts of given seeds file, either a SeedStore or keypairs loaded from a text seeds file."""
+    if is_seed_store(path):
+        return SeedStore(path)
+    return load_accounts(path)
+
+
+def signing_seeds(accounts) -> list:
+    """Return seeds of given accounts for a SigningPool, using raw seeds of a SeedStore to skip seed decoding."""
+    if isinstance(accounts, SeedStore):
+        return accounts.raw_seeds()
+    return [a.secret_seed for a in accounts]
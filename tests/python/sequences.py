@@ -0,0 +1,170 @@
+"""Fetch account sequence numbers from Horizon, and track them locally instead of fetching them after every transaction."""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+from helpers import LoggingClientSession
+from ledger_fetcher import get_with_retry
+
+
+SEQUENCE_CONCURRENCY = 50  # concurrent requests per endpoint
+SEQUENCE_RETRIES = 5
+SEQUENCE_BACKOFF = 0.5
+
+
+class SequenceManager:
+    """Account sequence numbers, fetched from Horizon once and incremented locally.
+
+    A sequence number is incremented for every successfully submitted transaction,
+    and is fetched again only after it was invalidated, e.g. following a tx_bad_seq result,
+    or a timeout where the submitted transaction may or may not have been applied.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, sequences=None):
+        self.session = session
+        self.sequences = dict(sequences or {})
+        self.fetches = 0
+
+    async def get(self, address, horizon_endpoint):
+        """Return the current sequence number of given account, fetching it from given Horizon if unknown."""
+        if address not in self.sequences:
+            self.sequences[address] = await self.fetch(address, horizon_endpoint)
+        return self.sequences[address]
+
+    async def fetch(self, address, horizon_endpoint):
+        """Fetch the current sequence number of given account from given Horizon, retrying with exponential backoff on failure."""
+        logging.debug('fetching sequence for account %s', address)
+        res = await get_with_retry(self.session, '{}/accounts/{}'.format(horizon_endpoint, address), None,
+                                   SEQUENCE_RETRIES, SEQUENCE_BACKOFF)
+        self.fetches += 1
+        return int(res['sequence'])
+
+    def advance(self, address):
+        """Increment sequence number of given account, following a successfully submitted transaction."""
+        self.sequences[address] += 1
+
+    def invalidate(self, address):
+        """Mark sequence number of given account as unknown, so it is fetched again on next use."""
+        self.sequences.pop(address, None)
+
+
+async def account_exists(session: aiohttp.ClientSession, horizon_endpoint, address,
+                         retries=SEQUENCE_RETRIES, backoff=SEQUENCE_BACKOFF):
+    """Return True if given account exists, False if Horizon doesn't know it e.g. because it was merged."""
+    url = '{}/accounts/{}'.format(horizon_endpoint, address)
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url) as res:
+                if res.status == 200:
+                    return True
+                if res.status == 404:
+                    return False
+                error = 'HTTP {}'.format(res.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        if attempt == retries:
+            raise RuntimeError('Failed getting account {} after {} retries: {}'.format(address, retries, error))
+
+        # add jitter so concurrent requests failing together won't retry together
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        logging.warning('failed getting account %s from %s, retrying in %.1f seconds: %s', address, horizon_endpoint, delay, error)
+        await asyncio.sleep(delay)
+
+
+async def fetch_sequence(session: aiohttp.ClientSession, semaphores, endpoints, index, address, retries, backoff):
+    """Fetch the current sequence number of given account.
+
+    The first request is sent to the endpoint at given index (modulo endpoint amount),
+    and every retry fails over to the next endpoint, after an exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        endpoint = endpoints[(index + attempt) % len(endpoints)]
+        try:
+            async with semaphores[endpoint]:
+                res = await get_with_retry(session, '{}/accounts/{}'.format(endpoint, address), None, 0, backoff)
+            return int(res['sequence'])
+        except (RuntimeError, KeyError, ValueError) as e:
+            error = e
+
+        if attempt == retries:
+            raise RuntimeError('Failed getting sequence for account {} after {} retries: {}'.format(address, retries, error))
+
+        # add jitter so concurrent requests failing together won't retry together
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        logging.warning('failed getting sequence for account %s from %s, retrying in %.1f seconds: %s', address, endpoint, delay, error)
+        await asyncio.sleep(delay)
+
+
+async def get_sequences_multiple_endpoints(endpoints, addresses, concurrency=SEQUENCE_CONCURRENCY, retries=SEQUENCE_RETRIES, backoff=SEQUENCE_BACKOFF):
+    """Get sequence for multiple accounts, using one of given endpoints.
+
+    endpoints are iterated one after the other in a round robin manner,
+    each serving up to given amount of concurrent requests.
+    Failed requests are retried using other endpoints, see fetch_sequence(),
+    and an account failing all retries is an error rather than a 0 sequence.
+    """
+    logging.info('getting sequence for %d accounts', len(addresses))
+
+    sequences = [None] * len(addresses)
+    semaphores = {e: asyncio.Semaphore(concurrency) for e in endpoints}
+    pending = iter(enumerate(addresses))
+    progress_every = max(1, len(addresses) // 10)
+    done = 0
+    start = time.time()
+
+    async def worker():
+        nonlocal done
+        # workers share the pending iterator, so only a bounded amount of requests is in flight
+        for i, address in pending:
+            sequences[i] = await fetch_sequence(session, semaphores, endpoints, i, address, retries, backoff)
+
+            done += 1
+            if done % progress_every == 0:
+                logging.info('got sequence for %d/%d accounts, %.0f accounts/s', done, len(addresses), done / (time.time() - start))
+
+    workers = min(len(addresses), concurrency * len(endpoints))
+    async with LoggingClientSession(connector=aiohttp.TCPConnector(limit=workers)) as session:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+
+    logging.info('finished getting sequence for %d accounts', len(addresses))
+    return sequences
+
+
+def load_sequences(path):
+    """Load {address: sequence} dictionary from given sequence cache file, or an empty dictionary if it doesn't exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_sequences(path, sequences):
+    """Save given {address: sequence} dictionary to given sequence cache file."""
+    # write to a temporary file first so an interrupted run doesn't leave a partial cache behind
+    with open(path + '.tmp', 'w') as f:
+        json.dump(sequences, f)
+    os.replace(path + '.tmp', path)
+
+
+async def get_sequences_cached(endpoints, addresses, cache_path):
+    """Get sequence for multiple accounts, reusing sequences saved in given cache file by previous runs.
+
+    Only accounts missing from the cache are fetched, and are then added to it.
+    NOTE cached sequences are valid only as long as the accounts didn't submit transactions since they were cached.
+    """
+    cached = load_sequences(cache_path)
+    missing = [a for a in addresses if a not in cached]
+    logging.info('%d account sequences found in cache %s', len(addresses) - len(missing), cache_path)
+
+    if missing:
+        cached.update(zip(missing, await get_sequences_multiple_endpoints(endpoints, missing)))
+        save_sequences(cache_path, cached)
+
+    return [cached[a] for a in addresses]
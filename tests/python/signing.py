@@ -0,0 +1,136 @@
+"""Sign transactions in a pool of worker processes initialized with all signing seeds.
+
+Worker processes receive the network passphrase and seeds once, when they start,
+and derive an account's keypair only when first signing for it.
+A signing job is then a compact tuple of account indexes, sequence number and operation specs,
+instead of a pickled Builder with its keypair and Horizon client, and only the transaction hash and XDR
+are sent back to the parent process.
+
+Signing job format: (source index, sequence, [op spec, ...], [extra signer index, ...])
+Operation spec format: (op type, destination address, amount, op source index or None),
+where op type is either 'payment', 'create_account' or 'account_merge' (whose amount is ignored).
+"""
+import asyncio
+import binascii
+import concurrent.futures
+import math
+import os
+
+from kin_base import operation
+from kin_base.asset import Asset
+from kin_base.keypair import Keypair as BaseKeypair
+from kin_base.network import NETWORKS
+from kin_base.transaction import Transaction
+from kin_base.transaction_envelope import TransactionEnvelope as Te
+
+
+# worker process state, set once by _init_worker()
+_passphrase = None
+_fee = None
+_seeds = None
+_keypairs = None  # {seed index: (keypair, address)}, derived on first use
+
+
+def _init_worker(passphrase, fee, seeds):
+    global _passphrase, _fee, _seeds, _keypairs
+    _passphrase = passphrase
+    _fee = fee
+    _seeds = seeds
+    _keypairs = {}
+
+
+def _keypair(i):
+    """Return keypair and address of given seed index, which is either a raw or an encoded seed."""
+    kp = _keypairs.get(i)
+    if kp is None:
+        seed = _seeds[i]
+        base_kp = BaseKeypair.from_raw_seed(seed) if isinstance(seed, bytes) else BaseKeypair.from_seed(seed)
+        kp = _keypairs[i] = (base_kp, base_kp.address().decode())
+    return kp
+
+
+def _build_op(spec):
+    op_type, destination, amount, source = spec
+    source = _keypair(source)[1] if source is not None else None
+
+    if op_type == 'payment':
+        return operation.Payment(destination, Asset('KIN'), str(amount), source)
+    if op_type == 'create_account':
+        return operation.CreateAccount(destination, str(amount), source)
+    if op_type == 'account_merge':
+        return operation.AccountMerge(destination, source)
+
+    raise ValueError('unsupported operation type {}'.format(op_type))
+
+
+def sign_tx(job):
+    """Build and sign a transaction according to given signing job, and return transaction hash and XDR.
+
+    Must be called from a worker process, see SigningPool.
+    """
+    source, sequence, ops, signers = job
+
+    # NOTE transaction sequence is set to given sequence + 1,
+    # i.e. given sequence is the source account's current sequence
+    tx = Transaction(source=_keypair(source)[1],
+                     sequence=sequence,
+                     fee=_fee * len(ops),
+                     operations=[_build_op(op) for op in ops])
+
+    te = Te(tx, network_id=_passphrase)
+    te.sign(_keypair(source)[0])
+    for i in signers:
+        te.sign(_keypair(i)[0])
+
+    return binascii.hexlify(te.hash_meta()).decode(), te.xdr().decode()
+
+
+def sign_txs(jobs):
+    """Sign a chunk of signing jobs, see sign_tx()."""
+    return [sign_tx(job) for job in jobs]
+
+
+class SigningPool:
+    """Worker processes signing transactions for a fixed list of accounts, referenced by index."""
+
+    def __init__(self, network, fee, seeds, workers=None):
+        # resolve network name to passphrase, since worker processes don't share registered networks
+        passphrase = NETWORKS.get(network, network)
+        self.workers = workers or os.cpu_count()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(passphrase, fee, list(seeds)))
+
+    async def sign(self, job):
+        """Sign a transaction according to given signing job, and return transaction hash and XDR."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, sign_tx, job)
+
+    async def iter_sign(self, jobs, chunk_size=None):
+        """Sign given signing jobs in chunks, and yield transaction hash and XDR for each job, in order.
+
+        Every chunk is sent to a worker process at once, saving an IPC round trip per transaction.
+        Chunk size defaults to splitting jobs evenly between workers.
+        """
+        jobs = list(jobs)
+        chunk_size = chunk_size or max(1, math.ceil(len(jobs) / self.workers))
+
+        loop = asyncio.get_running_loop()
+        futurs = [loop.run_in_executor(self.executor, sign_txs, jobs[i:i + chunk_size])
+                  for i in range(0, len(jobs), chunk_size)]
+
+        for f in futurs:
+            for res in await f:
+                yield res
+
+    async def sign_many(self, jobs, chunk_size=None):
+        """Sign given signing jobs in chunks, and return a list of transaction hash and XDR for each job, see iter_sign()."""
+        return [res async for res in self.iter_sign(jobs, chunk_size)]
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
@@ -1,11 +1,16 @@
 """Send prioritized and unprioritized transactions and verify prioritized transactions get priority when added to ledgers."""
 import argparse
 import asyncio
+import functools
+import itertools
 import json
 import logging
 import time
 
-from helpers import send_txs_multiple_endpoints
+import columnar
+from helpers import LoggingClientSession, send_txs_multiple_endpoints
+from ledger_clock import (LedgerClock, LedgerSchedule, TimerSchedule,
+                          horizon_ledger_closes, core_ledger_closes)
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -16,29 +21,55 @@ def parse_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--xdrs-file', type=str, help='Transaction XDR list file, in JSON lines format')
-    parser.add_argument('--out', default='spam-results-{}.json'.format(str(int(time.time()))), type=str, help='Spam results JSON output')
+    parser.add_argument('--out', type=str, help='Spam results output, defaults to spam-results-<timestamp>.json (or .npy if --columnar is set)')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Write spam results in columnar format (NumPy record batches, one per spam round) instead of JSON lines')
     parser.add_argument('--endpoint', required=True, action='append',
                         help='Endpoint URLs for submitting transactions (use multiple --endpoint flags for multiple addresses)')
     parser.add_argument('--submit-to-core', action='store_true', help='Submit to Core instead of Horizon')
     parser.add_argument('--avg-block-time', type=int, default=5, help='Average block time. Controls the time delay between every spam round and the one just after that')
 
+    parser.add_argument('--schedule', choices=['timer', 'ledger'], default='timer',
+                        help='Fire spam rounds every --avg-block-time seconds (timer), or whenever a ledger closes on the network (ledger)')
+    parser.add_argument('--ledger-endpoint', type=str,
+                        help='Endpoint URL to follow ledger closes from in ledger schedule: Horizon ledger stream, or Core /info if --submit-to-core is set. '
+                             'Defaults to the first --endpoint')
+    parser.add_argument('--fire-offset', type=float, default=0,
+                        help='Seconds after a ledger close to fire a spam round in ledger schedule. Negative values fire before the predicted close')
+    parser.add_argument('--core-poll-interval', type=float, default=0.25, help='Core /info polling interval when following ledger closes from Core')
+
+    parser.add_argument('--stream', action='store_true',
+                        help='Read spam rounds lazily and write results as each round finishes, keeping memory bounded by in-flight rounds')
+    parser.add_argument('--max-inflight-rounds', type=int, default=10, help='Maximum amount of spam rounds held in memory at once (stream mode only)')
+    parser.add_argument('--lead-time', type=float, default=1, help='Seconds before its slot a spam round is loaded and scheduled (stream mode only)')
+
     return parser.parse_args()
 
 
 def load_spam_rounds(path):
     """Load spam round transaction XDRs."""
-    spam_rounds = []
+    return list(iter_spam_rounds(path))
+
+
+def iter_spam_rounds(path):
+    """Lazily yield spam round transaction XDRs, reading a single round from disk at a time."""
     with open(path) as f:
         for rnd in f:
-            spam_rounds.append(json.loads(rnd))
-    return spam_rounds
+            yield json.loads(rnd)
 
 
-async def spam(endpoints, submit_to_horizon, spam_rounds, avg_block_time):
+def write_results(f, results):
+    """Write given transaction results to file in JSON lines format."""
+    for tx in results:
+        f.write('{}\n'.format(json.dumps(tx)))
+    f.flush()
+
+
+async def spam(endpoints, submit_to_horizon, spam_rounds, schedule):
     """Receive transaction XDR objects and submit them when their expected ledger arrives."""
     futurs = []
     for rnd, tx_metadata in enumerate(spam_rounds):
-        f = spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, avg_block_time)
+        f = spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, schedule)
 
         futurs.append(f)
 
@@ -46,12 +77,63 @@ async def spam(endpoints, submit_to_horizon, spam_rounds, avg_block_time):
     return results
 
 
-async def spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, avg_block_time):
-    """Receive transaction XDR objects for a specific future ledger and submit them when that ledger time arrives."""
+async def spam_stream(endpoints, submit_to_horizon, spam_rounds, schedule, write, max_inflight_rounds, lead_time):
+    """Submit spam rounds from given iterator, writing results using given function as soon as each round is done.
+
+    A round is read from the iterator only lead_time seconds before its expected ledger time,
+    and no more than max_inflight_rounds rounds are held in memory at once.
+    Thus memory usage depends on the amount of in-flight rounds and not on the test length.
+    """
+    inflight = asyncio.Semaphore(max_inflight_rounds)
+
+    async def run_round(tx_metadata, rnd):
+        try:
+            results = await spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, schedule)
+            write(results)
+        finally:
+            inflight.release()
+
+    futurs = set()
+
+    def collect(f):
+        # failed rounds are kept until their error is raised, so it isn't lost along with their results
+        if f.cancelled() or f.exception() is None:
+            futurs.discard(f)
+
+    for rnd in itertools.count():
+        # raise the error of a failed round, as gather() would once all rounds are done
+        for f in [f for f in futurs if f.done()]:
+            f.result()
+
+        await schedule.wait_for_slot(rnd, lead_time)
+
+        # wait for a previous round to finish if too many are in flight
+        await inflight.acquire()
+        tx_metadata = next(spam_rounds, None)
+        if tx_metadata is None:
+            inflight.release()
+            break
+
+        if schedule.is_late(rnd):
+            logging.warning('spam round %d is late, consider increasing --max-inflight-rounds', rnd)
+
+        f = asyncio.create_task(run_round(tx_metadata, rnd))
+        futurs.add(f)
+        f.add_done_callback(collect)
+
+    # wait for all remaining rounds to finish
+    await asyncio.gather(*futurs)
+
+
+async def spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, schedule):
+    """Receive transaction XDR objects for a specific future ledger and submit them when that ledger time arrives.
+
+    The ledger time is determined by given schedule.
+    """
     xdrs = [tx['xdr'] for tx in tx_metadata.values()]
 
     # start the spam round only when the expected ledger time arrives
-    await asyncio.sleep(rnd * avg_block_time)
+    await schedule.wait_for_slot(rnd)
 
     # submit transactions
     #
@@ -68,6 +150,12 @@ async def spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, avg_block_t
 
     logging.debug('done submitting %d transactions for round %d', len(xdrs), rnd)
 
+    # measure how far the submission was from the ledger close the round was scheduled by, if any
+    close_offset = await schedule.close_offset(rnd, submission_time)
+    if close_offset:
+        logging.info('spam round %d submitted %+.3f seconds from ledger %d close',
+                     rnd, close_offset['close_offset'], close_offset['target_ledger'])
+
     # create tx result object for each tx for reviewing later on
     results = []
     for (tx_hash, tx), tx_res in zip(tx_metadata.items(), tx_results):
@@ -77,7 +165,8 @@ async def spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, avg_block_t
             try:
                 ledger = tx_res['ledger']
             except KeyError:  # probably 504
-                pass
+                # keep the http status of horizon problem responses e.g. 500, 504
+                status = str(tx_res.get('status', ''))
         else:  # submit to core
             try:
                 status = tx_res['status']
@@ -99,18 +188,79 @@ async def spam_round(tx_metadata, endpoints, submit_to_horizon, rnd, avg_block_t
                         # if submitting to horizon
                         'ledger': ledger,
 
-                        # if submitting to core
+                        # if submitting to core, or horizon error status
                         'status': status,
                         'error': error,
+
+                        # if scheduling by ledger closes
+                        **close_offset,
                         })
 
     return results
 
 
+async def start_schedule(args, session):
+    """Create the spam round schedule according to given CLI arguments.
+
+    Return the schedule and the ledger following task if one was started.
+    """
+    if args.schedule == 'timer':
+        # in stream mode, leave enough time for the first round to be loaded
+        start = time.time() + (args.lead_time if args.stream else 0)
+        return TimerSchedule(args.avg_block_time, start), None
+
+    endpoint = args.ledger_endpoint or args.endpoint[0]
+    if args.submit_to_core:
+        closes = core_ledger_closes(session, endpoint, args.core_poll_interval)
+    else:
+        closes = horizon_ledger_closes(session, endpoint)
+
+    clock = LedgerClock(closes)
+    clock_task = asyncio.create_task(clock.run())
+
+    # in stream mode, slots are waited for lead_time seconds ahead of firing, see spam_stream()
+    schedule = LedgerSchedule(clock, args.fire_offset)
+    await schedule.start(args.lead_time if args.stream else 0)
+
+    return schedule, clock_task
+
+
 async def main():
     """Load spam transaction XDR objects for all spam rounds and submitting to the network in a timely manner."""
     args = parse_args()
 
+    async with LoggingClientSession() as session:
+        schedule, clock_task = await start_schedule(args, session)
+        try:
+            await run(args, schedule)
+        finally:
+            if clock_task:
+                clock_task.cancel()
+
+
+async def run(args, schedule):
+    """Submit spam rounds according to given schedule and write transaction results to file."""
+    if args.columnar:
+        out = args.out or 'spam-results-{}.npy'.format(int(time.time()))
+        mode, write_func = 'wb', columnar.write_batch
+    else:
+        out = args.out or 'spam-results-{}.json'.format(int(time.time()))
+        mode, write_func = 'w', write_results
+
+    if args.stream:
+        logging.info('starting spam, streaming transaction results to file %s', out)
+        with open(out, mode) as f:
+            await spam_stream(
+                args.endpoint,
+                submit_to_horizon=(not args.submit_to_core),
+                spam_rounds=iter_spam_rounds(args.xdrs_file),
+                schedule=schedule,
+                write=functools.partial(write_func, f),
+                max_inflight_rounds=args.max_inflight_rounds,
+                lead_time=args.lead_time)
+        logging.info('done')
+        return
+
     logging.info('load spam transaction xdr objects for spam rounds')
     spam_rounds = load_spam_rounds(args.xdrs_file)
 
@@ -119,14 +269,13 @@ async def main():
         args.endpoint,
         submit_to_horizon=(not args.submit_to_core),
         spam_rounds=spam_rounds,
-        avg_block_time=args.avg_block_time)
+        schedule=schedule)
     logging.info('done spamming')
 
-    logging.info('writing transaction results to file')
-    with open(args.out, 'w') as f:
-        for spam_round in results:
-            for tx in spam_round:
-                f.write('{}\n'.format(json.dumps(tx)))
+    logging.info('writing transaction results to file %s', out)
+    with open(out, mode) as f:
+        for round_results in results:
+            write_func(f, round_results)
 
     logging.info('done')
 
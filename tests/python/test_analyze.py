@@ -0,0 +1,52 @@
+"""Unit tests for analyze.py, run with: python -m unittest test_analyze"""
+import unittest
+
+import numpy as np
+
+import columnar
+from analyze import analyze, inclusion_ledgers, percentiles_higher
+
+
+# ledgers 10-12, closing every 5 seconds
+SEQS = np.array([10, 11, 12])
+CLOSE_TIMES = np.array([100., 105., 110.])
+FILL = np.array([0.5, 0.5, 0.5])
+
+
+def report(**fields):
+    """Return a single transaction report with given fields."""
+    tx = {'hash': 'a' * 64, 'round': 0, 'prioritized': False, 'ledger': '', **fields}
+    return columnar.to_records([tx])
+
+
+class TestAnalyze(unittest.TestCase):
+    def test_same_second_submission(self):
+        # submitted within the close second of ledger 11, before it closed, and included in it
+        r = report(submission_time=105.4, ledger_time=105.)
+
+        next_ledger, ledger = inclusion_ledgers(r, SEQS, CLOSE_TIMES)
+        self.assertEqual(next_ledger[0], 11)
+        self.assertEqual(ledger[0], 11)
+
+        stats = analyze(r, SEQS, CLOSE_TIMES, FILL)['overall']['unprioritized']
+        self.assertEqual(stats['next_ledger'], 1)
+        self.assertGreaterEqual(stats['latency']['p50'], 0)
+
+    def test_scheduled_submission(self):
+        # submitted after its target ledger 11 closed, though within its close second
+        r = report(submission_time=105.4, ledger_time=110., target_ledger=11, ledger_close_time=105.1, close_offset=0.3)
+        next_ledger, _ = inclusion_ledgers(r, SEQS, CLOSE_TIMES)
+        self.assertEqual(next_ledger[0], 12)
+
+        # submitted ahead of its target ledger 11
+        r = report(submission_time=104.9, ledger_time=105., target_ledger=11, ledger_close_time=105.1, close_offset=-0.2)
+        next_ledger, _ = inclusion_ledgers(r, SEQS, CLOSE_TIMES)
+        self.assertEqual(next_ledger[0], 11)
+
+    def test_percentiles_higher(self):
+        values = np.arange(10, dtype='f8')
+        np.testing.assert_array_equal(percentiles_higher(values, (0, 50, 90, 99, 100)), [0, 5, 9, 9, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()